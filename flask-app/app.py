@@ -1,12 +1,36 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
-import re  # Add this import at the top of the file
-from utils import make_links_clickable  # Import the function
-from pymongo import MongoClient
+from flask import Flask, render_template, stream_template, get_flashed_messages, request, redirect, url_for, session, flash, g, send_from_directory, make_response, jsonify, Response
+from jinja2 import FileSystemBytecodeCache
+from utils import make_links_clickable, attachment_name, attachment_stored_name, make_excerpt  # Import the functions
+from storage import store_upload, place_upload, discard_upload, remove_upload
+from previews import PreviewPool, remove_preview
+from indexes import ensure_indexes, find_collscans
+from transfer import export_collection, import_collection, archive_documents, insert_batch, BATCH_SIZE
+from assets import build_assets, load_manifest
+from jobs import JobQueue
+from cache import ResponseCache
+from database import get_db, LazyCollection, PROFILES, use_profile, last_write
+from metrics import RequestMetrics
+from live import CommentFeed
+from pymongo import ReturnDocument, UpdateOne
 from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from bson import json_util
 from dotenv import load_dotenv
 import os
+import re
+import json
+import hashlib
+import gzip
+import zlib
+import click
+import mimetypes
+import time
+import threading
+from collections import OrderedDict
+from functools import wraps
 from werkzeug.utils import secure_filename
-from datetime import datetime  # Add this import at the top of the file
+from werkzeug.security import safe_join
+from datetime import datetime, timedelta  # Add this import at the top of the file
 
 
 # Load environment variables
@@ -15,68 +39,422 @@ load_dotenv()
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY')
 
-# MongoDB setup
-client = MongoClient(os.getenv('MONGO_URI'))
-db = client.flask_db
-users = db.users
-posts = db.posts
-notifications = db.notifications
-comments = db.comments
-
-# Ensure admin and moderator roles exist
-if users.count_documents({'username': 'admin'}) == 0:
-    users.insert_one({'username': 'admin', 'email': 'admin@example.com', 'password': 'admin123', 'role': 'admin'})
+# Compiled templates are cached on disk (JINJA_CACHE_DIR, default: a temp directory)
+# so new worker processes skip recompiling them
+JINJA_CACHE_DIR = os.getenv('JINJA_CACHE_DIR')
+if JINJA_CACHE_DIR:
+    os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR)
+
+# Read-your-own-writes: for READ_YOUR_WRITES_SECONDS after a user's write, their
+# requests run in a causal session that starts after it, so pages read from
+# secondaries still show it. Set MONGO_CAUSAL_SESSIONS=0 for servers without sessions.
+MONGO_CAUSAL_SESSIONS = os.getenv('MONGO_CAUSAL_SESSIONS', '1') == '1'
+READ_YOUR_WRITES_SECONDS = int(os.getenv('READ_YOUR_WRITES_SECONDS', 120))
+
+# Streamed list pages are sent in chunks of about this many characters
+STREAM_CHUNK_SIZE = 8 * 1024
+
+# Static assets: `flask build-assets` writes fingerprinted, precompressed copies to
+# static/build, and url_for('static', ...) links to them once workers restart
+STATIC_BUILD_FOLDER = os.path.join(app.static_folder, 'build')
+asset_manifest = load_manifest(STATIC_BUILD_FOLDER)
+
+# HTML and JSON responses of at least COMPRESS_MIN_SIZE bytes are gzipped for clients
+# that accept it. Set COMPRESS_RESPONSES=0 when the front-end server compresses them.
+COMPRESS_RESPONSES = os.getenv('COMPRESS_RESPONSES', '1') == '1'
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+COMPRESS_LEVEL = 6
+COMPRESS_MIMETYPES = {'text/html', 'application/json'}
+
+# MongoDB setup: collections resolve to a per-process client on first use (see database.py).
+# Routes pick an access profile with @db_profile; notifications are written without acknowledgement.
+users = LazyCollection('users')
+posts = LazyCollection('posts')
+notifications = LazyCollection('notifications', profile='best_effort')
+comments = LazyCollection('comments')
+votes = LazyCollection('votes')
+uploads = LazyCollection('uploads')
+
+# Fields each view reads, so list pages fetch only what their templates show
+VIEW_FIELDS = {
+    'home': ['title', 'excerpt', 'attachment_urls', 'upvotes', 'downvotes', 'score'],
+    'profile': ['title', 'excerpt'],
+    'dashboard_topics': ['title', 'username', 'upvotes', 'downvotes'],
+    'dashboard_approve_reject': ['title', 'username', 'excerpt', 'attachment_urls'],
+    'dashboard_pending': ['title', 'username', 'status'],
+    'dashboard_profiles': ['username', 'email', 'role', 'total_contribution'],
+    'search': ['title'],
+    'view_post': ['title', 'content', 'attachment_urls'],
+    'view_post_comments': ['username', 'comment', 'attachment_urls'],
+    'comments_api': ['username', 'comment', 'comment_html', 'attachment_urls', 'parent_comment_id', 'timestamp'],
+}
+
+def fields(view):
+    return {field: 1 for field in VIEW_FIELDS[view]}
+
+# Notifications expire after NOTIFICATION_TTL_DAYS (applied by `flask db-init`)
+NOTIFICATION_TTL_DAYS = int(os.getenv('NOTIFICATION_TTL_DAYS', 30))
+
+# Rendered-page cache for read-heavy routes, invalidated by the write routes
+page_cache = ResponseCache(max_entries=int(os.getenv('RESPONSE_CACHE_SIZE', 1024)),
+                           ttl=int(os.getenv('RESPONSE_CACHE_TTL', 60)))
+
+# Background workers for the side effects of write requests; JOBS_SYNC=1 runs them inline
+jobs = JobQueue(workers=int(os.getenv('JOB_WORKERS', 2)), sync=os.getenv('JOBS_SYNC') == '1', logger=app.logger)
+
+# Set QUERY_PLAN_CHECK=warn or error in development to explain the app's queries
+# at startup and report any that would scan a whole collection
+QUERY_PLAN_CHECK = os.getenv('QUERY_PLAN_CHECK')
+
+# Request instrumentation exposed on /metrics (set METRICS_TOKEN to require it as a
+# bearer token). Requests slower than SLOW_REQUEST_MS are logged with their queries.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+SLOW_REQUEST_MS = os.getenv('SLOW_REQUEST_MS')
+request_metrics = RequestMetrics(slow_request_seconds=int(SLOW_REQUEST_MS) / 1000 if SLOW_REQUEST_MS else None,
+                                 logger=app.logger)
+if METRICS_ENABLED:
+    request_metrics.init_app(app)
 
 # Configure upload folder
 UPLOAD_FOLDER = 'static/uploads'
 ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg', 'doc', 'docx'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
+# Upload size limits: Flask rejects oversized request bodies before parsing them,
+# and each file is also checked while it is streamed to disk
+MAX_ATTACHMENT_SIZE = int(os.getenv('MAX_ATTACHMENT_SIZE', 16 * 1024 * 1024))
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_CONTENT_LENGTH', 64 * 1024 * 1024))
+
+# An upload of a file that is being deleted waits up to this long for the deletion to finish
+UPLOAD_DELETE_WAIT_SECONDS = 5
+
+# Attachment serving: content-addressed files never change, so they are cached for a
+# year. Set USE_X_SENDFILE=1 (Apache/lighttpd) or X_ACCEL_REDIRECT_PREFIX (nginx
+# internal location) to hand the file transfer to the front-end server.
+CONTENT_HASH_NAME = re.compile(r'([0-9a-f]{64})(\.\w+)?')
+ATTACHMENT_MAX_AGE = 365 * 24 * 60 * 60
+X_ACCEL_REDIRECT_PREFIX = os.getenv('X_ACCEL_REDIRECT_PREFIX')
+app.use_x_sendfile = os.getenv('USE_X_SENDFILE') == '1'
+
+# Attachment previews (thumbnails and PDF text snippets) are generated after upload
+# in PREVIEW_WORKERS processes (0 generates them inline) and served like attachments
+PREVIEW_FOLDER = os.path.join(UPLOAD_FOLDER, 'previews')
+PREVIEW_NAME = re.compile(r'[0-9a-f]{64}-\d+\.jpg')
+preview_pool = PreviewPool(workers=int(os.getenv('PREVIEW_WORKERS', 2)))
+
+# Comment thread settings
+COMMENTS_PER_PAGE = 20
+MAX_COMMENT_DEPTH = 5
+MAX_REPLIES_SHOWN = 10
+
+# Live comment updates (LIVE_UPDATES=1): every open thread page holds an event stream
+# or long-poll, and with it a server thread, so only enable them behind an async
+# worker such as gevent. Without them comments are still posted without a reload.
+# Set LIVE_CHANGE_STREAMS=1 on a replica set to also see comments from other processes.
+LIVE_UPDATES = os.getenv('LIVE_UPDATES') == '1'
+LIVE_POLL_SECONDS = 15
+LIVE_MAX_WAIT = 30
+LIVE_STREAM_SECONDS = int(os.getenv('LIVE_STREAM_SECONDS', 300))
+comment_feed = CommentFeed(logger=app.logger)
+if os.getenv('LIVE_CHANGE_STREAMS') == '1':
+    comment_feed.watch(comments)
+
+# Home feed settings
+FEED_PAGE_SIZE = 20
+
+# Dashboard settings
+DASHBOARD_PAGE_SIZE = 50
+DASHBOARD_STATS_TTL = int(os.getenv('DASHBOARD_STATS_TTL', 30))
+dashboard_stats_cache = {'stats': None, 'expires_at': 0}
+
+# Notifications feed settings
+NOTIFICATIONS_PER_PAGE = 30
+
+# Search settings
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_TERMS = 10
+SEARCH_CACHE_SIZE = 256
+SEARCH_CACHE_TTL = 60
+search_cache = OrderedDict()
+search_cache_lock = threading.Lock()
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def save_attachments(files):
+    """
+    Store uploaded files under their content hash and return their URLs.
+    Each stored file keeps a reference count in the uploads collection.
+    """
+    attachment_urls = []
+    for attachment in files:
+        if attachment and allowed_file(attachment.filename):
+            try:
+                stored_name, size, temp_path = store_upload(attachment, app.config['UPLOAD_FOLDER'],
+                                                            MAX_ATTACHMENT_SIZE)
+            except ValueError:
+                flash(f'{attachment.filename} is too large and was not uploaded.', 'error')
+                continue
+            try:
+                # Record the reference before placing the file, so a concurrent
+                # release either sees it or has finished deleting the old copy
+                upload = uploads.find_one_and_update(
+                    {'_id': stored_name},
+                    {'$inc': {'refs': 1}, '$setOnInsert': {'size': size}},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
+                )
+                if upload.get('deleting'):
+                    wait_for_upload_deletion(stored_name)
+                written = place_upload(temp_path, app.config['UPLOAD_FOLDER'], stored_name)
+            finally:
+                discard_upload(temp_path)
+            if written or upload['refs'] == 1:
+                jobs.submit(generate_attachment_preview, stored_name)
+            attachment_urls.append(url_for('serve_attachment', stored_name=stored_name,
+                                           name=secure_filename(attachment.filename)))
+    return attachment_urls
+
+def release_attachment(stored_name):
+    """
+    Drop one reference to a stored file and delete the file once nothing references it.
+    The upload document is marked 'deleting' while the file is removed, so an upload
+    of the same file in the meantime waits and writes it again instead of relying on
+    the copy being deleted. Repeating it would drop a second reference, so run it
+    with jobs.submit_once().
+    """
+    upload = uploads.find_one_and_update(
+        {'_id': stored_name},
+        {'$inc': {'refs': -1}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not upload or upload['refs'] > 0:
+        return
+    if not uploads.find_one_and_update({'_id': stored_name, 'refs': {'$lte': 0}, 'deleting': {'$ne': True}},
+                                       {'$set': {'deleting': True}}):
+        return  # Referenced again, or another release is deleting it
+    remove_upload(app.config['UPLOAD_FOLDER'], stored_name)
+    remove_preview(PREVIEW_FOLDER, stored_name)
+    if not uploads.delete_one({'_id': stored_name, 'refs': {'$lte': 0}}).deleted_count:
+        # Uploaded again meanwhile: the new upload writes the file once this flag is gone
+        uploads.update_one({'_id': stored_name}, {'$unset': {'deleting': ''}})
+
+def wait_for_upload_deletion(stored_name):
+    deadline = time.monotonic() + UPLOAD_DELETE_WAIT_SECONDS
+    while uploads.find_one({'_id': stored_name, 'deleting': True}, {'_id': 1}):
+        if time.monotonic() > deadline:
+            # The deleting release never finished; take the document over
+            uploads.update_one({'_id': stored_name}, {'$unset': {'deleting': ''}})
+            return
+        time.sleep(0.05)
+
+def generate_attachment_preview(stored_name):
+    """
+    Background job: render an upload's preview in the process pool and store it
+    on the upload document, then drop cached pages that could show it.
+    """
+    if not uploads.find_one({'_id': stored_name}, {'_id': 1}):
+        return  # Deleted before its preview was generated
+    preview = preview_pool.generate(app.config['UPLOAD_FOLDER'], PREVIEW_FOLDER, stored_name)
+    uploads.update_one({'_id': stored_name}, {'$set': {'preview': preview}})
+    if preview:
+        page_cache.invalidate('previews')
+
+def load_previews(attachment_urls):
+    """
+    Fetch the previews for a page's attachments in one query, keyed by stored name.
+    """
+    stored_names = list({attachment_stored_name(url) for url in attachment_urls})
+    if not stored_names:
+        return {}
+    return {
+        upload['_id']: upload['preview']
+        for upload in uploads.find({'_id': {'$in': stored_names}, 'preview': {'$exists': True}}, {'preview': 1})
+    }
+
+# Role caching: a role stays in the session for ROLE_CACHE_TTL seconds, and
+# role_changed_at lets this process refresh it early after a role change
+ROLE_CACHE_TTL = 60
+role_changed_at = {}
+
 # Helper functions
+def current_role():
+    """
+    Resolve the logged-in user's role at most once per request.
+    """
+    if 'username' not in session:
+        return None
+    if 'role' not in g:
+        username = session['username']
+        cached_at = session.get('role_cached_at', 0)
+        if time.time() - cached_at > ROLE_CACHE_TTL or role_changed_at.get(username, 0) >= cached_at:
+            user = users.find_one({'username': username}, {'role': 1})
+            cache_role(user['role'] if user else None)
+        g.role = session['role']
+    return g.role
+
+def cache_role(role):
+    session['role'] = role
+    session['role_cached_at'] = time.time()
+
+def invalidate_role(username):
+    role_changed_at[username] = time.time()
+    if username == session.get('username'):
+        g.pop('role', None)
+
 def is_admin():
-    return 'username' in session and users.find_one({'username': session['username'], 'role': 'admin'})
+    return current_role() == 'admin'
 
 def is_moderator():
-    return 'username' in session and users.find_one({'username': session['username'], 'role': 'moderator'})
+    return current_role() == 'moderator'
 
 
 # Helper function to add notifications
-def add_notification(message):
-    notification = {
-        'message': message,
-        'timestamp': datetime.now()
-    }
-    notifications.insert_one(notification)
+def add_notification(message, recipient=None):
+    add_notifications([(message, recipient)])
 
-# Make helper functions available in templates
-@app.context_processor
-def utility_processor():
-    return dict(is_admin=is_admin, is_moderator=is_moderator)
+def add_notifications(entries):
+    """
+    Queue (message, recipient) notifications for insertion in one batch.
+    Personal notifications also bump their recipients' unread counters.
+    """
+    now = datetime.now()
+    batch = []
+    unread = {}
+    for message, recipient in entries:
+        # Ids are assigned here so a retried insert skips what already went in
+        notification = {'_id': ObjectId(), 'message': message, 'timestamp': now}
+        if recipient:
+            notification['recipient'] = recipient
+            unread[recipient] = unread.get(recipient, 0) + 1
+        batch.append(notification)
+    if batch:
+        jobs.submit(insert_batch, notifications, batch)
+    if unread:
+        jobs.submit_once(increment_unread_notifications, unread)
+
+def increment_unread_notifications(unread):
+    users.bulk_write([
+        UpdateOne({'username': username}, {'$inc': {'unread_notifications': count}})
+        for username, count in unread.items()
+    ], ordered=False)
+
+def adjust_user_counters(username, inc):
+    """
+    Apply $inc to a user's denormalized counters. Runs as a background job, so it
+    resolves the collection itself instead of taking a method bound to the
+    request's database session. Submit it with jobs.submit_once().
+    """
+    users.update_one({'username': username}, {'$inc': inc})
 
+def wrote_recently():
+    return time.time() - session.get('last_write_at', 0) <= READ_YOUR_WRITES_SECONDS
 
-# Helper function to convert URLs into clickable links
-def make_links_clickable(text):
-    # Regex to detect URLs
-    url_pattern = re.compile(r'https?://\S+')
-    # Replace URLs with clickable links
-    return url_pattern.sub(r'<a href="\g<0>" target="_blank">\g<0></a>', text)
+def cached_page(tags):
+    """
+    Cache a logged-in GET page per URL, user and role. tags receives the view's
+    arguments and returns the tags write routes use to invalidate the page.
+    Responses carry an ETag so unchanged pages revalidate with 304 Not Modified.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            # Pages with pending flash messages are always rendered fresh, as are
+            # pages shortly after the user's own write: a cached copy (or one filled
+            # from a lagging secondary) could be missing it
+            if 'username' not in session or '_flashes' in session or wrote_recently():
+                return view(**kwargs)
+
+            key = (request.full_path, session['username'], current_role())
+            cached = page_cache.get(key)
+            if cached is None:
+                response = make_response(view(**kwargs))
+                if response.status_code != 200:
+                    return response
+                if response.is_streamed:
+                    # Send the page as it renders and cache it once it is complete
+                    response.response = cache_when_complete(response.iter_encoded(), key, response.mimetype,
+                                                            tags(**kwargs))
+                    return response
+                body = response.get_data()
+                cached = (body, response.mimetype, hashlib.sha1(body).hexdigest())
+                page_cache.set(key, cached, tags(**kwargs))
+
+            body, mimetype, etag = cached
+            response = app.response_class(body, mimetype=mimetype)
+            response.set_etag(etag)
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            response.vary.add('Cookie')
+            return response.make_conditional(request)
+        return wrapper
+    return decorator
+
+def cache_when_complete(chunks, key, mimetype, tags):
+    body = []
+    for chunk in chunks:
+        body.append(chunk)
+        yield chunk
+    body = b''.join(body)
+    page_cache.set(key, (body, mimetype, hashlib.sha1(body).hexdigest()), tags)
+
+def stream_page(template_name, **context):
+    """
+    Render a template as a streamed response, so rows are sent while the cursor
+    in the context is still being read. Output is sent in STREAM_CHUNK_SIZE pieces.
+    """
+    # The session cookie is sent before the body, so take the flashed messages now
+    get_flashed_messages(with_categories=True)
+
+    def chunks(parts):
+        buffer, size = [], 0
+        for part in parts:
+            buffer.append(part)
+            size += len(part)
+            if size >= STREAM_CHUNK_SIZE:
+                yield ''.join(buffer)
+                buffer, size = [], 0
+        if buffer:
+            yield ''.join(buffer)
+
+    return app.response_class(chunks(stream_template(template_name, **context)), mimetype='text/html')
+
+def db_profile(profile):
+    """
+    Run a view with a database access profile from database.PROFILES. Views whose
+    profile writes, and any view shortly after the user's own write, get a causal
+    session; the operation time of a view's writes is kept in the user's session.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            after = session.get('last_write') if wrote_recently() else None
+            causal = MONGO_CAUSAL_SESSIONS and (after is not None or 'write_concern' in PROFILES[profile])
+            with use_profile(profile, causal=causal, after=after) as access:
+                if access['session'] is not None:
+                    # Ended at teardown, after any streamed body has read its cursors
+                    g.setdefault('db_sessions', []).append(access['session'])
+                response = view(**kwargs)
+                if access['wrote']:
+                    session['last_write_at'] = time.time()
+                    if last_write(access):
+                        session['last_write'] = last_write(access)
+            return response
+        return wrapper
+    return decorator
+
+@app.teardown_request
+def end_db_sessions(error=None):
+    for db_session in g.pop('db_sessions', []):
+        db_session.end_session()
 
-# Make the helper function available in templates
+# Make helper functions available in templates
 @app.context_processor
 def utility_processor():
     return dict(is_admin=is_admin, is_moderator=is_moderator, make_links_clickable=make_links_clickable)
 
-
-def make_links_clickable(text):
-    """
-    Convert URLs in text to clickable links (colored blue and opening in a new tab).
-    """
-    url_pattern = re.compile(r'https?://\S+')
-    return url_pattern.sub(r'<a href="\g<0>" target="_blank" style="color: blue;">\g<0></a>', text)
-
 # Routes
 @app.route('/')
 def index():
@@ -92,12 +470,14 @@ def login():
         user = users.find_one({'email': email, 'password': password})
         if user:
             session['username'] = user['username']
+            cache_role(user.get('role'))
             return redirect(url_for('home'))
         else:
             flash('Invalid email or password', 'error')
     return render_template('login.html')
 
 @app.route('/edit_post/<post_id>', methods=['GET', 'POST'])
+@db_profile('majority')
 def edit_post(post_id):
     if 'username' not in session:
         return redirect(url_for('login'))
@@ -118,13 +498,7 @@ def edit_post(post_id):
         attachments = request.files.getlist('attachments')
 
         # Save new attachments if provided
-        attachment_urls = post.get('attachment_urls', [])
-        for attachment in attachments:
-            if attachment and allowed_file(attachment.filename):
-                filename = secure_filename(attachment.filename)
-                attachment_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                attachment.save(attachment_path)
-                attachment_urls.append(url_for('static', filename=f'uploads/{filename}'))
+        attachment_urls = post.get('attachment_urls', []) + save_attachments(attachments)
 
         # Update the post
         posts.update_one(
@@ -133,10 +507,13 @@ def edit_post(post_id):
                 '$set': {
                     'title': title,
                     'content': content,
+                    'content_html': str(make_links_clickable(content)),
+                    'excerpt': make_excerpt(content),
                     'attachment_urls': attachment_urls
                 }
             }
         )
+        page_cache.invalidate(f'post:{post_id}', 'feed')
         flash('Post updated successfully!', 'success')
         return redirect(url_for('profile', username=session['username']))
     
@@ -144,6 +521,7 @@ def edit_post(post_id):
 
 
 @app.route('/delete_post/<post_id>')
+@db_profile('majority')
 def delete_post(post_id):
     if 'username' not in session:
         return redirect(url_for('login'))
@@ -158,16 +536,153 @@ def delete_post(post_id):
         flash('You do not have permission to delete this post.', 'error')
         return redirect(url_for('home'))
     
-    # Delete the post
+    # Delete the post; its votes, files, counters and notification are handled in the background
     posts.delete_one({'_id': ObjectId(post_id)})
-    
-    # Add notification for post deletion
-    add_notification(f"{session['username']} deleted the post: {post['title']}")
+    page_cache.invalidate(f'post:{post_id}', 'feed')
+    clean_up_deleted_post(post, session['username'])
     
     flash('Post deleted successfully!', 'success')
     return redirect(url_for('profile', username=session['username']))
 
+
+def clean_up_deleted_post(post, deleted_by):
+    """
+    Queue the removal of what a deleted post leaves behind and notify about the
+    deletion. Each step is its own job, so a failed step is retried alone and the
+    reference and counter decrements are never applied twice.
+    """
+    jobs.submit(delete_post_votes, post['_id'])
+    for url in post.get('attachment_urls', []):
+        jobs.submit_once(release_attachment, attachment_stored_name(url))
+    jobs.submit_once(adjust_user_counters, post['username'], {
+        'post_count': -1,
+        'total_upvotes': -post.get('upvotes', 0),
+        'total_downvotes': -post.get('downvotes', 0),
+        'total_contribution': -(post.get('upvotes', 0) - post.get('downvotes', 0))
+    })
+
+    # Add notification for post deletion
+    add_notification(f"{deleted_by} deleted the post: {post['title']}")
+
+def delete_post_votes(post_id):
+    votes.delete_many({'post_id': post_id})
+
+@app.route('/attachments/<stored_name>')
+def serve_attachment(stored_name):
+    """
+    Serve an uploaded file with Range and conditional GET support.
+    Content-addressed files use their hash as a strong ETag and are marked immutable.
+    """
+    match = CONTENT_HASH_NAME.fullmatch(stored_name)
+    if not match:
+        # Files uploaded before content addressing may still change
+        return send_from_directory(app.config['UPLOAD_FOLDER'], stored_name, conditional=True)
+
+    etag = match.group(1)
+    if X_ACCEL_REDIRECT_PREFIX:
+        # nginx serves the body and handles Range and If-None-Match itself
+        response = app.response_class(mimetype=mimetypes.guess_type(stored_name)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = X_ACCEL_REDIRECT_PREFIX + stored_name
+        response.set_etag(etag)
+    else:
+        response = send_from_directory(
+            app.config['UPLOAD_FOLDER'],
+            stored_name,
+            conditional=True,
+            etag=etag,
+            max_age=ATTACHMENT_MAX_AGE,
+            download_name=secure_filename(request.args.get('name', '')) or stored_name
+        )
+    response.cache_control.public = True
+    response.cache_control.max_age = ATTACHMENT_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+@app.url_defaults
+def fingerprint_static_urls(endpoint, values):
+    """
+    Point url_for('static', filename=...) at the fingerprinted copy of built assets.
+    """
+    if endpoint == 'static' and values.get('filename') in asset_manifest:
+        values['filename'] = 'build/' + asset_manifest[values['filename']]
+
+@app.route('/static/build/<path:filename>')
+def serve_built_asset(filename):
+    """
+    Serve a fingerprinted asset, precompressed if the client accepts brotli or gzip.
+    The content hash is in the name, so it is cached for a year as immutable.
+    """
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    stored_name, encoding = filename, None
+    for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+        path = safe_join(STATIC_BUILD_FOLDER, filename + suffix)
+        if request.accept_encodings[candidate] and path and os.path.isfile(path):
+            stored_name, encoding = filename + suffix, candidate
+            break
+    response = send_from_directory(STATIC_BUILD_FOLDER, stored_name, mimetype=mimetype, conditional=True,
+                                   max_age=ATTACHMENT_MAX_AGE)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+@app.after_request
+def compress_response(response):
+    """
+    Gzip large HTML and JSON responses. Streamed pages are compressed chunk by chunk
+    and flushed after each one, so browsers can still render them as they arrive.
+    """
+    if (not COMPRESS_RESPONSES or response.status_code != 200 or response.mimetype not in COMPRESS_MIMETYPES
+            or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    if not request.accept_encodings['gzip']:
+        return response
+    if response.is_streamed:
+        response.response = gzip_stream(response.iter_encoded())
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < COMPRESS_MIN_SIZE:
+            return response
+        response.set_data(gzip.compress(body, COMPRESS_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    # The compressed bytes differ from what a strong ETag promised
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+def gzip_stream(chunks):
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+@app.route('/previews/<name>')
+def serve_preview(name):
+    """
+    Serve an attachment thumbnail. Names carry the content hash and width, so they are immutable.
+    """
+    if not PREVIEW_NAME.fullmatch(name):
+        return 'Not Found', 404
+    if X_ACCEL_REDIRECT_PREFIX:
+        response = app.response_class(mimetype='image/jpeg')
+        response.headers['X-Accel-Redirect'] = X_ACCEL_REDIRECT_PREFIX + 'previews/' + name
+        response.set_etag(name)
+    else:
+        response = send_from_directory(PREVIEW_FOLDER, name, conditional=True, etag=name,
+                                       max_age=ATTACHMENT_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.max_age = ATTACHMENT_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+
 @app.route('/signup', methods=['GET', 'POST'])
+@db_profile('majority')
 def signup():
     if request.method == 'POST':
         username = request.form['username']
@@ -182,24 +697,45 @@ def signup():
     return render_template('signup.html')
 
 @app.route('/home')
+@cached_page(lambda: ['feed', 'previews'])
+@db_profile('feed')
 def home():
     if 'username' not in session:
         return redirect(url_for('login'))
 
-    # Fetch approved posts and calculate contribution
-    all_posts = posts.find({'status': 'approved'})
-    posts_with_contribution = []
-    for post in all_posts:
-        contribution = post.get('upvotes', 0) - post.get('downvotes', 0)
-        post['contribution'] = contribution
-        posts_with_contribution.append(post)
+    # Fetch one page of approved posts ranked by score
+    feed_posts, next_cursor = fetch_feed(request.args.get('cursor'))
+    previews = load_previews(url for post in feed_posts for url in post.get('attachment_urls', []))
+    return stream_page('home.html', posts=feed_posts, next_cursor=next_cursor, previews=previews)
 
-    # Sort posts by contribution (descending order)
-    posts_with_contribution.sort(key=lambda x: x['contribution'], reverse=True)
 
-    return render_template('home.html', posts=posts_with_contribution)
+def fetch_feed(cursor=None):
+    """
+    Fetch a page of approved posts ordered by score, newest first on ties.
+    The cursor is '<score>_<post id>' of the last post on the previous page.
+    Returns the posts and the cursor for the next page (None on the last page).
+    """
+    query = {'status': 'approved'}
+    if cursor:
+        try:
+            score, last_id = cursor.split('_', 1)
+            score, last_id = int(score), ObjectId(last_id)
+            query['$or'] = [
+                {'score': {'$lt': score}},
+                {'score': score, '_id': {'$lt': last_id}}
+            ]
+        except (ValueError, InvalidId):
+            pass  # Malformed cursor, start from the first page
+
+    page = list(posts.find(query, fields('home')).sort([('score', -1), ('_id', -1)]).limit(FEED_PAGE_SIZE + 1))
+    if len(page) <= FEED_PAGE_SIZE:
+        return page, None
+    page = page[:FEED_PAGE_SIZE]
+    last = page[-1]
+    return page, f"{last['score']}_{last['_id']}"
 
 @app.route('/create_post', methods=['GET', 'POST'])
+@db_profile('majority')
 def create_post():
     if 'username' not in session:
         return redirect(url_for('login'))
@@ -210,17 +746,11 @@ def create_post():
         attachments = request.files.getlist('attachments')
 
         # Save attachments if provided
-        attachment_urls = []
-        for attachment in attachments:
-            if attachment and allowed_file(attachment.filename):
-                filename = secure_filename(attachment.filename)
-                attachment_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                attachment.save(attachment_path)
-                attachment_urls.append(url_for('static', filename=f'uploads/{filename}'))
-
-        # Calculate the user's total contribution
-        user_posts = posts.find({'username': session['username']})
-        total_contribution = sum(post.get('upvotes', 0) - post.get('downvotes', 0) for post in user_posts)
+        attachment_urls = save_attachments(attachments)
+
+        # Read the user's total contribution from their counters
+        user = users.find_one({'username': session['username']}, {'total_contribution': 1})
+        total_contribution = user.get('total_contribution', 0) if user else 0
 
         # Set post status based on total contribution
         status = 'approved' if total_contribution >= 50 else 'pending'
@@ -229,19 +759,22 @@ def create_post():
         post = {
             'title': title,
             'content': content,
+            'content_html': str(make_links_clickable(content)),
+            'excerpt': make_excerpt(content),
             'username': session['username'],
             'upvotes': 0,
             'downvotes': 0,
-            'upvoted_by': [],
-            'downvoted_by': [],
+            'score': 0,
             'status': status,
             'attachment_urls': attachment_urls,
             'timestamp': datetime.now()
         }
         posts.insert_one(post)
+        page_cache.invalidate('feed')
+        jobs.submit_once(adjust_user_counters, session['username'], {'post_count': 1})
 
         # Add notification for post creation
-        add_notification(f"{session['username']} created a post: {title}")
+        jobs.submit(add_notification, f"{session['username']} created a post: {title}")
 
         flash(f'Post created successfully! Status: {status}.', 'success')
         return redirect(url_for('home'))
@@ -249,56 +782,80 @@ def create_post():
     return render_template('create_post.html')
 
 @app.route('/upvote/<post_id>')
+@db_profile('majority')
 def upvote(post_id):
     if 'username' not in session:
         return redirect(url_for('login'))
 
-    post = posts.find_one({'_id': ObjectId(post_id)})
-    if not post:
+    result = cast_vote(post_id, session['username'], 1)
+    if result == 'not_found':
         flash('Post not found', 'error')
         return redirect(url_for('home'))
 
-    if session['username'] in post.get('upvoted_by', []):
+    if result == 'duplicate':
         flash('You have already upvoted this post.', 'error')
     else:
-        posts.update_one(
-            {'_id': ObjectId(post_id)},
-            {
-                '$inc': {'upvotes': 1},
-                '$push': {'upvoted_by': session['username']}
-            }
-        )
         flash('Post upvoted!', 'success')
 
     return redirect(url_for('view_topic', post_id=post_id))
 
 
 @app.route('/downvote/<post_id>')
+@db_profile('majority')
 def downvote(post_id):
     if 'username' not in session:
         return redirect(url_for('login'))
 
-    post = posts.find_one({'_id': ObjectId(post_id)})
-    if not post:
+    result = cast_vote(post_id, session['username'], -1)
+    if result == 'not_found':
         flash('Post not found', 'error')
         return redirect(url_for('home'))
 
-    if session['username'] in post.get('downvoted_by', []):
+    if result == 'duplicate':
         flash('You have already downvoted this post.', 'error')
     else:
-        posts.update_one(
-            {'_id': ObjectId(post_id)},
-            {
-                '$inc': {'downvotes': 1},
-                '$push': {'downvoted_by': session['username']}
-            }
-        )
         flash('Post downvoted!', 'success')
 
     return redirect(url_for('view_topic', post_id=post_id))
 
 
+def cast_vote(post_id, username, value):
+    """
+    Record a user's vote (1 or -1) on a post and adjust the post's and its author's counters.
+    The vote document is swapped atomically, so concurrent clicks can't count
+    twice and switching sides moves the vote from one counter to the other.
+    Returns 'voted', 'duplicate' or 'not_found'.
+    """
+    previous = votes.find_one_and_update(
+        {'post_id': ObjectId(post_id), 'username': username},
+        {'$set': {'value': value, 'timestamp': datetime.now()}},
+        upsert=True,
+        return_document=ReturnDocument.BEFORE
+    )
+    if previous and previous['value'] == value:
+        return 'duplicate'
+
+    inc = {'upvotes' if value == 1 else 'downvotes': 1, 'score': value}
+    if previous:
+        inc['downvotes' if value == 1 else 'upvotes'] = -1
+        inc['score'] = 2 * value
+
+    post = posts.find_one_and_update({'_id': ObjectId(post_id)}, {'$inc': inc}, projection={'username': 1})
+    if not post:
+        votes.delete_one({'post_id': ObjectId(post_id), 'username': username})
+        return 'not_found'
+    page_cache.invalidate(f'post:{post_id}', 'feed')
+
+    jobs.submit_once(adjust_user_counters, post['username'], {
+        'total_upvotes': inc.get('upvotes', 0),
+        'total_downvotes': inc.get('downvotes', 0),
+        'total_contribution': inc['score']
+    })
+    return 'voted'
+
+
 @app.route('/add_comment/<post_id>', methods=['POST'])
+@db_profile('majority')
 def add_comment(post_id):
     if 'username' not in session:
         return redirect(url_for('login'))
@@ -307,20 +864,24 @@ def add_comment(post_id):
     parent_comment_id = request.form.get('parent_comment_id')  # Optional: ID of the parent comment
     attachments = request.files.getlist('attachments')
 
+    create_comment(post_id, comment_text, parent_comment_id, attachments)
+    flash('Comment added successfully!', 'success')
+    return redirect(url_for('view_topic', post_id=post_id))
+
+
+def create_comment(post_id, comment_text, parent_comment_id, attachments):
+    """
+    Store a comment from the logged-in user and fan out its side effects:
+    the post author's notification, cached pages and live thread subscribers.
+    """
     # Save attachments if provided
-    attachment_urls = []
-    for attachment in attachments:
-        if attachment and allowed_file(attachment.filename):
-            filename = secure_filename(attachment.filename)
-            attachment_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            attachment.save(attachment_path)
-            attachment_urls.append(url_for('static', filename=f'uploads/{filename}'))
+    attachment_urls = save_attachments(attachments)
 
-    # Create the comment
     comment = {
         'post_id': ObjectId(post_id),
         'username': session['username'],
         'comment': comment_text,
+        'comment_html': str(make_links_clickable(comment_text)),
         'attachment_urls': attachment_urls,
         'parent_comment_id': ObjectId(parent_comment_id) if parent_comment_id else None,
         'timestamp': datetime.now()
@@ -328,26 +889,180 @@ def add_comment(post_id):
     comments.insert_one(comment)
 
     # Add notification for comment addition
-    post = posts.find_one({'_id': ObjectId(post_id)})
-    add_notification(f"{session['username']} commented on the post: {post['title']}")
+    jobs.submit(notify_comment, post_id, session['username'])
 
-    flash('Comment added successfully!', 'success')
-    return redirect(url_for('view_topic', post_id=post_id))
+    page_cache.invalidate(f'post:{post_id}')
+    comment_feed.publish(post_id)
+    return comment
 
 
-def fetch_comments(post_id, parent_comment_id=None):
+@app.route('/api/posts/<post_id>/comments', methods=['GET', 'POST'])
+@db_profile('majority')
+def comments_api(post_id):
     """
-    Recursively fetch comments and replies for a post.
+    JSON comments API. POST (JSON or multipart form) adds a comment; GET returns
+    comments newer than the ?after=<comment id> cursor, oldest first. With ?wait=N
+    an empty GET long-polls for up to N seconds before answering.
     """
-    query = {'post_id': ObjectId(post_id), 'parent_comment_id': parent_comment_id}
-    comments_list = list(comments.find(query).sort('timestamp', 1))
+    if 'username' not in session:
+        return jsonify(error='Login required'), 401
+    try:
+        post_oid = ObjectId(post_id)
+        after = request.args.get('after')
+        after = ObjectId(after) if after else None
+        data = request.get_json(silent=True) or request.form
+        parent_comment_id = data.get('parent_comment_id')
+        if request.method == 'POST' and parent_comment_id:
+            ObjectId(parent_comment_id)
+    except (InvalidId, TypeError):
+        return jsonify(error='Invalid id'), 400
 
-    for comment in comments_list:
-        comment['replies'] = fetch_comments(post_id, comment['_id'])  # Fetch replies recursively
-    return comments_list
+    if request.method == 'POST':
+        comment_text = (data.get('comment') or '').strip()
+        if not comment_text:
+            return jsonify(error='Comment is required'), 400
+        if not posts.find_one({'_id': post_oid}, {'_id': 1}):
+            return jsonify(error='Post not found'), 404
+        if parent_comment_id and not comments.find_one({'_id': ObjectId(parent_comment_id), 'post_id': post_oid},
+                                                       {'_id': 1}):
+            return jsonify(error='Parent comment not found on this post'), 400
+        comment = create_comment(post_id, comment_text, parent_comment_id, request.files.getlist('attachments'))
+        return jsonify(serialize_comment(comment)), 201
+
+    version = comment_feed.version(post_id)
+    new_comments = fetch_comments_after(post_oid, after)
+    wait = min(request.args.get('wait', 0, type=int), LIVE_MAX_WAIT) if LIVE_UPDATES else 0
+    if not new_comments and wait > 0 and comment_feed.wait(post_id, version, wait):
+        new_comments = fetch_comments_after(post_oid, after)
+    return jsonify(
+        comments=[serialize_comment(comment) for comment in new_comments],
+        cursor=str(new_comments[-1]['_id']) if new_comments else (str(after) if after else None),
+        has_more=len(new_comments) == COMMENTS_PER_PAGE
+    )
+
+
+@app.route('/api/posts/<post_id>/comments/stream')
+def comments_stream(post_id):
+    """
+    Server-sent events with each new comment on a post. Resumes after the
+    Last-Event-ID header (sent by EventSource on reconnect) or ?after=<comment id>.
+    Streams end after LIVE_STREAM_SECONDS and the browser reconnects.
+    """
+    if not LIVE_UPDATES:
+        return jsonify(error='Live updates are disabled'), 404
+    if 'username' not in session:
+        return jsonify(error='Login required'), 401
+    try:
+        post_oid = ObjectId(post_id)
+        after = request.headers.get('Last-Event-ID') or request.args.get('after')
+        after = ObjectId(after) if after else None
+    except InvalidId:
+        return jsonify(error='Invalid id'), 400
+
+    def events(cursor):
+        deadline = time.monotonic() + LIVE_STREAM_SECONDS
+        yield 'retry: 3000\n\n'
+        while time.monotonic() < deadline:
+            version = comment_feed.version(post_id)
+            new_comments = fetch_comments_after(post_oid, cursor)
+            for comment in new_comments:
+                cursor = comment['_id']
+                yield f'id: {cursor}\nevent: comment\ndata: {json.dumps(serialize_comment(comment))}\n\n'
+            # A full batch means there is more to send straight away
+            if len(new_comments) < COMMENTS_PER_PAGE and not comment_feed.wait(post_id, version, LIVE_POLL_SECONDS):
+                yield ': keep-alive\n\n'
+
+    return Response(events(after), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def fetch_comments_after(post_id, after=None):
+    """
+    Return up to COMMENTS_PER_PAGE comments on a post created after the comment id `after`.
+    """
+    query = {'post_id': post_id}
+    if after is not None:
+        query['_id'] = {'$gt': after}
+    return list(comments.find(query, fields('comments_api')).sort('_id', 1).limit(COMMENTS_PER_PAGE))
+
+
+def serialize_comment(comment):
+    return {
+        'id': str(comment['_id']),
+        'parent_comment_id': str(comment['parent_comment_id']) if comment.get('parent_comment_id') else None,
+        'username': comment['username'],
+        'comment_html': comment.get('comment_html') or str(make_links_clickable(comment['comment'])),
+        'attachments': [{'url': url, 'name': attachment_name(url)} for url in comment.get('attachment_urls', [])],
+        'timestamp': comment['timestamp'].isoformat()
+    }
+
+
+def notify_comment(post_id, commenter):
+    post = posts.find_one({'_id': ObjectId(post_id)}, {'title': 1, 'username': 1})
+    if post:
+        add_notification(f"{commenter} commented on the post: {post['title']}", recipient=post['username'])
+
+
+def fetch_comments(post_id, parent_comment_id=None, page=1):
+    """
+    Fetch a page of comments and their replies for a post with one indexed aggregation
+    per nesting level, down to MAX_COMMENT_DEPTH. Every level reads at most
+    MAX_REPLIES_SHOWN + 1 replies per shown comment, so the read stays bounded
+    however large the thread grows. Returns the comments and whether another page exists.
+    """
+    post_oid = ObjectId(post_id)
+    comments_list = list(
+        comments.find({'post_id': post_oid, 'parent_comment_id': parent_comment_id})
+        .sort('timestamp', 1)
+        .skip((page - 1) * COMMENTS_PER_PAGE)
+        .limit(COMMENTS_PER_PAGE + 1)
+    )
+    has_more = len(comments_list) > COMMENTS_PER_PAGE
+    comments_list = comments_list[:COMMENTS_PER_PAGE]
+
+    level = comments_list
+    for depth in range(MAX_COMMENT_DEPTH + 1):
+        if not level:
+            break
+        # Below the last shown level only check whether replies exist
+        level = attach_replies(post_oid, level, MAX_REPLIES_SHOWN if depth < MAX_COMMENT_DEPTH else 0)
+    return comments_list, has_more
+
+
+def attach_replies(post_id, parents, shown):
+    """
+    Load the oldest `shown` replies of each parent comment and flag parents with
+    replies left over as 'more_replies' so the template can link to them.
+    Each parent gets its own $limit-ed branch on the (post_id, parent_comment_id,
+    timestamp) index, combined with $unionWith into a single aggregation, so a
+    busy parent can't crowd out its siblings. Returns the replies attached.
+    """
+    def branch(parent):
+        return [
+            {'$match': {'post_id': post_id, 'parent_comment_id': parent['_id']}},
+            {'$sort': {'timestamp': 1}},
+            {'$limit': shown + 1},
+        ] + ([] if shown else [{'$project': {'parent_comment_id': 1}}])
+
+    pipeline = branch(parents[0]) + [
+        {'$unionWith': {'coll': 'comments', 'pipeline': branch(parent)}} for parent in parents[1:]
+    ]
+    children = {}
+    for reply in comments.aggregate(pipeline):
+        children.setdefault(reply['parent_comment_id'], []).append(reply)
+
+    replies = []
+    for parent in parents:
+        found = children.get(parent['_id'], [])
+        parent['replies'] = found[:shown]
+        parent['more_replies'] = len(found) > shown
+        replies.extend(parent['replies'])
+    return replies
 
 
 @app.route('/view_topic/<post_id>')
+@cached_page(lambda post_id: [f'post:{post_id}', 'previews'])
+@db_profile('feed')
 def view_topic(post_id):
     if 'username' not in session:
         return redirect(url_for('login'))
@@ -361,22 +1076,46 @@ def view_topic(post_id):
     # Fetch the author's details
     author = users.find_one({'username': post['username']})
 
-    # Fetch comments and replies
-    post_comments = fetch_comments(post_id)
+    # Fetch a page of comments and replies (optionally rooted at a single thread)
+    page = max(request.args.get('page', 1, type=int), 1)
+    thread = request.args.get('thread')
+    try:
+        thread_id = ObjectId(thread) if thread else None
+    except InvalidId:
+        thread = thread_id = None  # Malformed thread id, show the whole post
+    post_comments, has_more_comments = fetch_comments(post_id, thread_id, page)
 
     # Calculate total contribution
     total_contribution = post.get('upvotes', 0) - post.get('downvotes', 0)
 
+    # Previews for the post's and the shown comments' attachments
+    attachment_urls = list(post.get('attachment_urls', []))
+    shown = list(post_comments)
+    while shown:
+        comment = shown.pop()
+        attachment_urls.extend(comment.get('attachment_urls', []))
+        shown.extend(comment.get('replies', []))
+
+    # Live updates resume from the newest comment this render has seen
+    latest = LIVE_UPDATES and comments.find_one({'post_id': post['_id']}, {'_id': 1}, sort=[('_id', -1)])
+
     return render_template(
         'view_topic.html',
+        comments_cursor=str(latest['_id']) if latest else '',
+        live_updates=LIVE_UPDATES,
+        previews=load_previews(attachment_urls),
         post=post,
         author=author,
         comments=post_comments,
+        has_more_comments=has_more_comments,
+        page=page,
+        thread=thread,
         total_contribution=total_contribution
     )
 
 
 @app.route('/profile/<username>')
+@db_profile('feed')
 def profile(username):
     if 'username' not in session:
         return redirect(url_for('login'))
@@ -388,24 +1127,16 @@ def profile(username):
         return redirect(url_for('home'))
 
     # Fetch the user's posts
-    user_posts = list(posts.find({'username': username}))
-
-    # Calculate total contribution, upvotes, and downvotes
-    total_contribution = 0
-    total_upvotes = 0
-    total_downvotes = 0
-    for post in user_posts:
-        total_contribution += post.get('upvotes', 0) - post.get('downvotes', 0)
-        total_upvotes += post.get('upvotes', 0)
-        total_downvotes += post.get('downvotes', 0)
+    user_posts = list(posts.find({'username': username}, fields('profile')))
 
+    # Totals are kept up to date on the user document
     return render_template(
         'profile.html',
         user=user,
         posts=user_posts,
-        total_contribution=total_contribution,
-        total_upvotes=total_upvotes,
-        total_downvotes=total_downvotes
+        total_contribution=user.get('total_contribution', 0),
+        total_upvotes=user.get('total_upvotes', 0),
+        total_downvotes=user.get('total_downvotes', 0)
     )
 
 
@@ -414,9 +1145,26 @@ def notifications_page():
     if 'username' not in session:
         return redirect(url_for('login'))
 
-    # Fetch notifications sorted by timestamp
-    all_notifications = notifications.find().sort('timestamp', -1)
-    return render_template('notification.html', notifications=all_notifications)
+    # Fetch one page of notifications, newest first, optionally only the user's own
+    mine = request.args.get('mine') == '1'
+    query = {'recipient': session['username']} if mine else {}
+    before = request.args.get('before')
+    if before and ObjectId.is_valid(before):
+        query['_id'] = {'$lt': ObjectId(before)}
+    # ObjectIds increase with insertion time, so _id doubles as a tie-free cursor
+    page = list(notifications.find(query).sort('_id', -1).limit(NOTIFICATIONS_PER_PAGE + 1))
+    next_cursor = page[NOTIFICATIONS_PER_PAGE - 1]['_id'] if len(page) > NOTIFICATIONS_PER_PAGE else None
+
+    # Reading the feed clears the unread counter
+    user = users.find_one_and_update(
+        {'username': session['username']},
+        {'$set': {'unread_notifications': 0}},
+        projection={'unread_notifications': 1}
+    )
+    unread = user.get('unread_notifications', 0) if user else 0
+
+    return stream_page('notification.html', notifications=page[:NOTIFICATIONS_PER_PAGE],
+                       next_cursor=next_cursor, mine=mine, unread=unread)
 
 
 
@@ -426,22 +1174,17 @@ def dashboard():
         return redirect(url_for('login'))
 
     # Fetch dashboard data (e.g., post statistics, user activity, etc.)
-    post_stats = {
-        'approved': posts.count_documents({'status': 'approved'}),
-        'pending': posts.count_documents({'status': 'pending'}),
-        'rejected': posts.count_documents({'status': 'rejected'}),
-        'total': posts.count_documents({})
-    }
-
-    user_activity = {
-        'comments': comments.count_documents({}),
-        'upvotes': sum(post.get('upvotes', 0) for post in posts.find()),
-        'downvotes': sum(post.get('downvotes', 0) for post in posts.find())
-    }
+    post_stats, user_activity = fetch_dashboard_stats()
 
-    approved_topics = list(posts.find({'status': 'approved'}, {'title': 1})) or []
-    all_users = list(users.find({}, {'username': 1, 'role': 1})) or []
-    pending_posts = list(posts.find({'status': 'pending'})) if is_moderator() else []
+    topics_page = max(request.args.get('topics_page', 1, type=int), 1)
+    users_page = max(request.args.get('users_page', 1, type=int), 1)
+    approved_topics, more_topics = fetch_page(
+        posts.find({'status': 'approved'}, {'title': 1}).sort('_id', -1), topics_page
+    )
+    all_users, more_users = fetch_page(
+        users.find({}, {'username': 1, 'role': 1}).sort('_id', 1), users_page
+    )
+    pending_posts = list(posts.find({'status': 'pending'}, fields('dashboard_pending')).limit(DASHBOARD_PAGE_SIZE)) if is_moderator() else []
 
     return render_template(
         'dashboard.html',
@@ -449,11 +1192,53 @@ def dashboard():
         user_activity=user_activity,
         approved_topics=approved_topics,
         all_users=all_users,
-        pending_posts=pending_posts
+        pending_posts=pending_posts,
+        topics_page=topics_page,
+        users_page=users_page,
+        more_topics=more_topics,
+        more_users=more_users
     )
 
 
+def fetch_dashboard_stats():
+    """
+    Compute post counts and vote totals in a single aggregation.
+    The result is cached in-process for DASHBOARD_STATS_TTL seconds.
+    """
+    if dashboard_stats_cache['stats'] and time.time() < dashboard_stats_cache['expires_at']:
+        return dashboard_stats_cache['stats']
+
+    post_stats = {'approved': 0, 'pending': 0, 'rejected': 0, 'total': 0}
+    user_activity = {'comments': comments.estimated_document_count(), 'upvotes': 0, 'downvotes': 0}
+    pipeline = [{'$group': {
+        '_id': '$status',
+        'count': {'$sum': 1},
+        'upvotes': {'$sum': '$upvotes'},
+        'downvotes': {'$sum': '$downvotes'}
+    }}]
+    for group in posts.aggregate(pipeline):
+        if group['_id'] in post_stats:
+            post_stats[group['_id']] = group['count']
+        post_stats['total'] += group['count']
+        user_activity['upvotes'] += group['upvotes']
+        user_activity['downvotes'] += group['downvotes']
+
+    dashboard_stats_cache['stats'] = (post_stats, user_activity)
+    dashboard_stats_cache['expires_at'] = time.time() + DASHBOARD_STATS_TTL
+    return post_stats, user_activity
+
+
+def fetch_page(cursor, page, per_page=DASHBOARD_PAGE_SIZE):
+    """
+    Apply skip/limit paging to a cursor.
+    Returns the items and whether another page exists.
+    """
+    items = list(cursor.skip((page - 1) * per_page).limit(per_page + 1))
+    return items[:per_page], len(items) > per_page
+
+
 @app.route('/assign_moderator/<username>', methods=['POST'])
+@db_profile('majority')
 def assign_moderator(username):
     if not is_admin():
         flash('You do not have permission to perform this action.', 'error')
@@ -461,9 +1246,11 @@ def assign_moderator(username):
 
     # Update the user's role to moderator
     users.update_one({'username': username}, {'$set': {'role': 'moderator'}})
+    invalidate_role(username)
 
     # Add notification for moderator assignment
-    add_notification(f"{username} has been assigned as a moderator by {session['username']}")
+    jobs.submit(add_notification, f"{username} has been assigned as a moderator by {session['username']}",
+                recipient=username)
 
     flash(f'{username} has been assigned as a moderator.', 'success')
     return redirect(url_for('dashboard'))
@@ -471,6 +1258,7 @@ def assign_moderator(username):
 
 # Route for dashboard form submission (renamed)
 @app.route('/dashboard/assign_moderator', methods=['POST'])
+@db_profile('majority')
 def dashboard_assign_moderator():  # Unique function name
     if not is_admin():
         flash('Permission denied.', 'error')
@@ -482,6 +1270,7 @@ def dashboard_assign_moderator():  # Unique function name
         return redirect(url_for('dashboard'))
 
     users.update_one({'username': username}, {'$set': {'role': 'moderator'}})
+    invalidate_role(username)
     flash(f'{username} assigned as moderator.', 'success')
     return redirect(url_for('dashboard'))
 
@@ -493,126 +1282,406 @@ def dashboard_approve_reject():
         return redirect(url_for('home'))
     
     # Fetch pending posts for moderators
-    pending_posts = posts.find({'status': 'pending'})
-    return render_template('dashboard_approve_reject.html', posts=pending_posts)
+    pending_posts = list(posts.find({'status': 'pending'}, fields('dashboard_approve_reject')))
+    previews = load_previews(url for post in pending_posts for url in post.get('attachment_urls', []))
+    return render_template('dashboard_approve_reject.html', posts=pending_posts, previews=previews)
 
 @app.route('/dashboard/topics')
+@cached_page(lambda: ['feed'])
+@db_profile('feed')
 def dashboard_topics():
     if not is_admin() and not is_moderator():
         flash('You do not have permission to access this page.', 'error')
         return redirect(url_for('home'))
     
     # Fetch approved posts
-    approved_posts = posts.find({'status': 'approved'})
-    return render_template('dashboard_topics.html', posts=approved_posts)
+    approved_posts = posts.find({'status': 'approved'}, fields('dashboard_topics'))
+    return stream_page('dashboard_topics.html', posts=approved_posts)
 
 @app.route('/dashboard/profiles')
+@db_profile('feed')
 def dashboard_profiles():
     if not is_admin() and not is_moderator():
         flash('You do not have permission to access this page.', 'error')
         return redirect(url_for('home'))
     
     # Fetch all users
-    all_users = users.find()
-    return render_template('dashboard_profiles.html', users=all_users)
+    all_users = users.find({}, fields('dashboard_profiles'))
+    return stream_page('dashboard_profiles.html', users=all_users)
 
 @app.route('/approve_post/<post_id>')
+@db_profile('majority')
 def approve_post(post_id):
     if not is_moderator():
         flash('You do not have permission to perform this action.', 'error')
         return redirect(url_for('home'))
     posts.update_one({'_id': ObjectId(post_id)}, {'$set': {'status': 'approved'}})
+    page_cache.invalidate(f'post:{post_id}', 'feed')
     flash('Post approved successfully!', 'success')
     return redirect(url_for('dashboard_topics'))
 
 # Single Post Rejection
 @app.route('/reject_post/<post_id>')
+@db_profile('majority')
 def reject_post(post_id):
     if not is_moderator():
         flash('Permission denied.', 'error')
         return redirect(url_for('home'))
 
     # Update post status to 'rejected' instead of deleting
-    posts.update_one(
+    post = posts.find_one_and_update(
         {'_id': ObjectId(post_id)},
-        {'$set': {'status': 'rejected'}}
+        {'$set': {'status': 'rejected', 'rejected_at': datetime.now()}},
+        projection={'title': 1, 'username': 1}
     )
+    if not post:
+        flash('Post not found', 'error')
+        return redirect(url_for('dashboard_topics'))
 
     # Add notification
-    post = posts.find_one({'_id': ObjectId(post_id)})
-    add_notification(f"{session['username']} rejected the post: {post['title']}")
+    jobs.submit(add_notification, f"{session['username']} rejected the post: {post['title']}",
+                recipient=post['username'])
 
+    page_cache.invalidate(f'post:{post_id}', 'feed')
     flash('Post rejected successfully!', 'success')
     return redirect(url_for('dashboard_topics'))
 
 # Bulk Rejection
 @app.route('/bulk_actions', methods=['POST'])
+@db_profile('majority')
 def bulk_actions():
     if not is_moderator():
         flash('Permission denied.', 'error')
         return redirect(url_for('dashboard'))
 
-    post_ids = request.form.getlist('post_ids')
+    post_ids = [ObjectId(pid) for pid in request.form.getlist('post_ids')]
     action = request.form.get('action')
-
-    if action == 'approve':
-        for pid in post_ids:
-            posts.update_one(
-                {'_id': ObjectId(pid)},
-                {'$set': {'status': 'approved'}}
-            )
-        flash(f'Approved {len(post_ids)} posts.', 'success')
-    elif action == 'reject':
-        for pid in post_ids:
-            posts.update_one(
-                {'_id': ObjectId(pid)},
-                {'$set': {'status': 'rejected'}}
-            )
-        flash(f'Rejected {len(post_ids)} posts.', 'success')
+    statuses = {'approve': 'approved', 'reject': 'rejected'}
+
+    if action in statuses and post_ids:
+        status = statuses[action]
+        selected = {'_id': {'$in': post_ids}, 'status': {'$ne': status}}
+        # Read titles for the notifications, then update every post in one write
+        moderated = list(posts.find(selected, {'title': 1, 'username': 1}))
+        changes = {'status': status}
+        if status == 'rejected':
+            changes['rejected_at'] = datetime.now()  # Starts the archive grace period
+        posts.update_many({'_id': {'$in': [post['_id'] for post in moderated]}}, {'$set': changes})
+        page_cache.invalidate('feed', *[f"post:{post['_id']}" for post in moderated])
+        jobs.submit(add_notifications, [
+            (f"{session['username']} {status} the post: {post['title']}", post['username'])
+            for post in moderated
+        ])
+        flash(f'{status.capitalize()} {len(moderated)} posts.', 'success')
 
     return redirect(url_for('dashboard'))
 
 
 @app.route('/post/<post_id>')
+@cached_page(lambda post_id: [f'post:{post_id}'])
+@db_profile('feed')
 def view_post(post_id):
-    post = posts.find_one({'_id': ObjectId(post_id)})
+    post = posts.find_one({'_id': ObjectId(post_id)}, fields('view_post'))
     if not post:
         flash('Post not found.', 'error')
         return redirect(url_for('dashboard'))
 
     # Fetch comments for the post
-    post_comments = list(comments.find({'post_id': ObjectId(post_id)}))
+    post_comments = list(comments.find({'post_id': ObjectId(post_id)}, fields('view_post_comments')))
 
     return render_template('view_post.html', post=post, comments=post_comments)
 
 
-@app.route('/search', methods=['POST'])
+@app.route('/search', methods=['GET', 'POST'])
+@db_profile('feed')
 def search():
     if 'username' not in session:
         return redirect(url_for('login'))
-    query = request.form['query']
-    search_type = request.form['search_type']
+    query = request.values.get('query', '')
+    search_type = request.values.get('search_type', 'topic')
+    page = max(request.values.get('page', 1, type=int), 1)
 
     if search_type == 'topic':
-        results = posts.find({'title': {'$regex': query, '$options': 'i'}, 'status': 'approved'})
-        return render_template('search_results.html', results=results, search_type='topic')
+        results, has_more = search_topics(query, page)
+        return render_template('search_results.html', results=results, search_type='topic',
+                               query=query, page=page, has_more=has_more)
     elif search_type == 'email':
         user = users.find_one({'email': query})
         if user:
-            results = posts.find({'username': user['username'], 'status': 'approved'})
-            return render_template('search_results.html', results=results, search_type='email', user=user)
+            results, has_more = fetch_page(
+                posts.find({'username': user['username'], 'status': 'approved'}, fields('search')).sort('_id', -1),
+                page, SEARCH_PAGE_SIZE
+            )
+            return render_template('search_results.html', results=results, search_type='email', user=user,
+                                   query=query, page=page, has_more=has_more)
         else:
             flash('User not found', 'error')
             return redirect(url_for('home'))
     return redirect(url_for('home'))
 
+
+def search_topics(query, page):
+    """
+    Rank approved posts against the words in query using the posts text index.
+    Only plain words are searched, so text-search operators in user input are ignored.
+    Results are cached for SEARCH_CACHE_TTL seconds in a small LRU cache.
+    Returns a page of results and whether another page exists.
+    """
+    terms = ' '.join(re.findall(r'\w+', query.lower())[:SEARCH_MAX_TERMS])
+    if not terms:
+        return [], False
+
+    key = (terms, page)
+    with search_cache_lock:
+        cached = search_cache.get(key)
+        if cached and cached[0] > time.time():
+            search_cache.move_to_end(key)
+            return cached[1]
+
+    cursor = posts.find(
+        {'$text': {'$search': terms}, 'status': 'approved'},
+        {**fields('search'), 'relevance': {'$meta': 'textScore'}}
+    ).sort([('relevance', {'$meta': 'textScore'})])
+    result = fetch_page(cursor, page, SEARCH_PAGE_SIZE)
+
+    with search_cache_lock:
+        search_cache[key] = (time.time() + SEARCH_CACHE_TTL, result)
+        search_cache.move_to_end(key)
+        while len(search_cache) > SEARCH_CACHE_SIZE:
+            search_cache.popitem(last=False)
+    return result
+
 @app.route('/logout')
 def logout():
     session.pop('username', None)
+    session.pop('role', None)
+    session.pop('role_cached_at', None)
     return redirect(url_for('login'))
 
+@app.route('/metrics')
+def metrics():
+    if not METRICS_ENABLED:
+        return 'Not Found', 404
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return 'Unauthorized', 401
+    response = make_response(request_metrics.render())
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
+
+def seed_db():
+    """
+    Ensure admin and moderator roles exist.
+    """
+    if users.count_documents({'username': 'admin'}) == 0:
+        users.insert_one({'username': 'admin', 'email': 'admin@example.com', 'password': 'admin123', 'role': 'admin'})
+
+
+def migrate_db():
+    """
+    Backfill fields introduced by schema changes. Safe to run repeatedly.
+    """
+    # Backfill the denormalized ranking score on posts created before it existed
+    posts.update_many(
+        {'score': {'$exists': False}},
+        [{'$set': {'score': {'$subtract': [{'$ifNull': ['$upvotes', 0]}, {'$ifNull': ['$downvotes', 0]}]}}}]
+    )
+
+    # Move voter lists still embedded in posts into the votes collection
+    for post in posts.find({'$or': [{'upvoted_by': {'$exists': True}}, {'downvoted_by': {'$exists': True}}]},
+                           {'upvoted_by': 1, 'downvoted_by': 1}):
+        vote_writes = [
+            UpdateOne({'post_id': post['_id'], 'username': username}, {'$setOnInsert': {'value': value}}, upsert=True)
+            for field, value in (('upvoted_by', 1), ('downvoted_by', -1))
+            for username in post.get(field, [])
+        ]
+        if vote_writes:
+            votes.bulk_write(vote_writes, ordered=False)
+        posts.update_one({'_id': post['_id']}, {'$unset': {'upvoted_by': '', 'downvoted_by': ''}})
+
+    # Backfill the plain-text excerpts shown on list pages, in batches
+    excerpt_writes = []
+    for post in posts.find({'excerpt': {'$exists': False}}, {'content': 1}):
+        excerpt_writes.append(UpdateOne({'_id': post['_id']}, {'$set': {'excerpt': make_excerpt(post.get('content', ''))}}))
+        if len(excerpt_writes) == 1000:
+            posts.bulk_write(excerpt_writes, ordered=False)
+            excerpt_writes = []
+    if excerpt_writes:
+        posts.bulk_write(excerpt_writes, ordered=False)
+
+
+def reconcile_user_counters():
+    """
+    Rebuild every user's post and vote counters from the posts collection.
+    """
+    pipeline = [{'$group': {
+        '_id': '$username',
+        'post_count': {'$sum': 1},
+        'total_upvotes': {'$sum': '$upvotes'},
+        'total_downvotes': {'$sum': '$downvotes'}
+    }}]
+    totals = {group['_id']: group for group in posts.aggregate(pipeline)}
+
+    counter_writes = []
+    for user in users.find({}, {'username': 1}):
+        group = totals.get(user['username'], {})
+        counters = {field: group.get(field, 0) for field in ('post_count', 'total_upvotes', 'total_downvotes')}
+        counters['total_contribution'] = counters['total_upvotes'] - counters['total_downvotes']
+        counter_writes.append(UpdateOne({'_id': user['_id']}, {'$set': counters}))
+    if counter_writes:
+        users.bulk_write(counter_writes, ordered=False)
+    return len(counter_writes)
+
+
+@app.cli.command('db-init')
+def db_init_command():
+    """Seed the admin account, create the app's indexes and backfill migrated fields and counters."""
+    seed_db()
+    migrate_db()
+    reconcile_user_counters()
+    ensure_indexes(get_db(), NOTIFICATION_TTL_DAYS * 24 * 60 * 60)
+    click.echo('Database initialized.')
+
+
+@app.cli.command('reconcile-counters')
+def reconcile_counters_command():
+    """Recompute per-user contribution counters from their posts."""
+    click.echo(f'Reconciled counters for {reconcile_user_counters()} users.')
+
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Fingerprint and precompress static assets into static/build."""
+    manifest = build_assets(app.static_folder, STATIC_BUILD_FOLDER)
+    click.echo(f'Built {len(manifest)} assets into {STATIC_BUILD_FOLDER}; restart the app to serve them.')
+
+
+@app.cli.command('generate-previews')
+def generate_previews_command():
+    """Generate previews for uploads that don't have one yet."""
+    count = 0
+    for upload in uploads.find({'preview': {'$exists': False}}, {'_id': 1}):
+        generate_attachment_preview(upload['_id'])
+        count += 1
+    click.echo(f'Generated previews for {count} uploads.')
+
+
+# Collections the export and import commands accept, including the archives
+TRANSFER_COLLECTIONS = ['users', 'posts', 'comments', 'votes', 'notifications', 'uploads',
+                        'posts_archive', 'comments_archive', 'votes_archive', 'notifications_archive']
+
+
+@app.cli.command('export')
+@click.argument('collection', type=click.Choice(TRANSFER_COLLECTIONS))
+@click.argument('path')
+@click.option('--query', help='Extended JSON filter, e.g. \'{"status": "approved"}\'.')
+@click.option('--batch-size', default=BATCH_SIZE, show_default=True)
+def export_command(collection, path, query, batch_size):
+    """Stream a collection to NDJSON at PATH (gzip-compressed if it ends in .gz)."""
+    count = export_collection(get_db()[collection], path, json_util.loads(query) if query else None, batch_size)
+    click.echo(f'Exported {count} documents from {collection} to {path}.')
+
+
+@app.cli.command('import')
+@click.argument('collection', type=click.Choice(TRANSFER_COLLECTIONS))
+@click.argument('path')
+@click.option('--batch-size', default=BATCH_SIZE, show_default=True)
+def import_command(collection, path, batch_size):
+    """Load an NDJSON export into a collection, skipping documents that already exist."""
+    inserted, skipped = import_collection(get_db()[collection], path, batch_size)
+    click.echo(f'Imported {inserted} documents into {collection} ({skipped} already present).')
+
+
+@app.cli.command('archive')
+@click.option('--rejected-days', default=30, show_default=True, help='Archive posts rejected longer ago than this.')
+@click.option('--notification-days', default=14, show_default=True,
+              help='Archive notifications older than this (keep it below NOTIFICATION_TTL_DAYS).')
+@click.option('--batch-size', default=BATCH_SIZE, show_default=True)
+def archive_command(rejected_days, notification_days, batch_size):
+    """Move old rejected posts, with their comments and votes, and old notifications into archive collections."""
+    db = get_db()
+    moved = {'comments': 0, 'votes': 0}
+
+    def archive_post_children(post_ids):
+        for name in moved:
+            moved[name] += archive_documents(db[name], db[f'{name}_archive'], {'post_id': {'$in': post_ids}}, batch_size)
+
+    # The grace period runs from the rejection; posts rejected before rejected_at
+    # was recorded fall back to their creation time
+    rejected_before = datetime.now() - timedelta(days=rejected_days)
+    post_count = archive_documents(
+        db.posts, db.posts_archive,
+        {'status': 'rejected', '$or': [
+            {'rejected_at': {'$lt': rejected_before}},
+            {'rejected_at': {'$exists': False}, 'timestamp': {'$lt': rejected_before}}
+        ]},
+        batch_size, on_batch=archive_post_children
+    )
+    notification_count = archive_documents(
+        db.notifications, db.notifications_archive,
+        {'timestamp': {'$lt': datetime.now() - timedelta(days=notification_days)}},
+        batch_size
+    )
+    click.echo(f"Archived {post_count} rejected posts ({moved['comments']} comments, {moved['votes']} votes) "
+               f'and {notification_count} notifications.')
+    if post_count:
+        click.echo('Run `flask reconcile-counters` to drop archived posts from user counters.')
+
+
+@app.cli.command('check-queries')
+def check_queries_command():
+    """Explain the app's queries and fail if any of them is a COLLSCAN."""
+    collscans = find_collscans(get_db())
+    for collscan in collscans:
+        click.echo(f'COLLSCAN: {collscan}', err=True)
+    if collscans:
+        raise SystemExit(1)
+    click.echo('All queries use an index.')
+
+
 # Register the custom filter
 app.jinja_env.filters['make_links_clickable'] = make_links_clickable
+app.jinja_env.filters['attachment_name'] = attachment_name
+app.jinja_env.filters['attachment_stored_name'] = attachment_stored_name
+
+
+startup = {'done': False, 'lock': threading.Lock()}
+
+def run_startup_checks():
+    """
+    Preload templates and run the QUERY_PLAN_CHECK, once per process. They need
+    the database, so they run here rather than at import time.
+    """
+    with startup['lock']:
+        if startup['done']:
+            return
+        # Load every template up front (from the bytecode cache when warm), so workers
+        # forked from a preloaded app start with them compiled
+        for template_name in app.jinja_env.list_templates():
+            app.jinja_env.get_template(template_name)
+        if QUERY_PLAN_CHECK:
+            collscans = find_collscans(get_db())
+            if collscans and QUERY_PLAN_CHECK == 'error':
+                raise RuntimeError('Queries without a usable index: ' + '; '.join(collscans))
+            for collscan in collscans:
+                app.logger.warning('COLLSCAN: %s', collscan)
+        startup['done'] = True
+
+# `flask run` serves the module-level app without calling create_app(), so the
+# checks also run before the first request that reaches the app
+@app.before_request
+def ensure_startup_checks():
+    if not startup['done']:
+        run_startup_checks()
+
+def create_app():
+    """
+    Application factory for WSGI servers (see wsgi.py).
+    Routes are registered on the module-level app; this runs the startup checks
+    up front, so a preloaded app forks workers that have already passed them.
+    """
+    run_startup_checks()
+    return app
+
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    create_app().run(debug=os.getenv('FLASK_DEBUG') == '1')
\ No newline at end of file
@@ -0,0 +1,60 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+
+# Brotli is optional; without it assets are only precompressed with gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Files smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.map'}
+
+def build_assets(static_folder, build_folder, skip=('uploads',)):
+    """
+    Copy every static file into build_folder under a name that includes a hash of
+    its content (css/style.css -> css/style.<hash>.css) and write .gz and, when
+    brotli is installed, .br variants of text assets next to it. Subfolders of
+    static_folder listed in skip are left out, as is build_folder itself.
+    Writes manifest.json mapping original to fingerprinted paths and returns it.
+    """
+    manifest = {}
+    skipped = {os.path.join(static_folder, name) for name in skip} | {build_folder}
+    for root, folders, files in os.walk(static_folder):
+        folders[:] = [folder for folder in folders if os.path.join(root, folder) not in skipped]
+        for filename in files:
+            source = os.path.join(root, filename)
+            path = os.path.relpath(source, static_folder).replace(os.sep, '/')
+            with open(source, 'rb') as asset:
+                content = asset.read()
+            stem, extension = os.path.splitext(path)
+            hashed_path = f'{stem}.{hashlib.sha256(content).hexdigest()[:12]}{extension}'
+            target = os.path.join(build_folder, hashed_path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(source, target)
+            if extension.lower() in COMPRESSIBLE_EXTENSIONS and len(content) >= MIN_COMPRESS_SIZE:
+                with open(target + '.gz', 'wb') as compressed:
+                    compressed.write(gzip.compress(content, 9))
+                if brotli is not None:
+                    with open(target + '.br', 'wb') as compressed:
+                        compressed.write(brotli.compress(content, quality=11))
+            manifest[path] = hashed_path
+
+    with open(os.path.join(build_folder, 'manifest.json'), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    return manifest
+
+def load_manifest(build_folder):
+    """
+    Read the manifest written by build_assets, or return an empty one if assets
+    haven't been built (static files are then served unversioned).
+    """
+    try:
+        with open(os.path.join(build_folder, 'manifest.json')) as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return {}
@@ -0,0 +1,268 @@
+# Benchmark harness for the main routes.
+#
+# Seeds a synthetic dataset into a scratch database and drives the routes through
+# the Flask test client, reporting latency percentiles, throughput and MongoDB
+# round trips per request. The scratch database (--db, flask_bench by default) is
+# dropped, so MONGO_URI must be set explicitly rather than read from .env, and the
+# app's own database is refused. Run against a local mongod:
+#   MONGO_URI=mongodb://localhost:27017 python benchmark.py --posts 2000
+# or fully in memory (requires `pip install mongomock`):
+#   python benchmark.py --mongomock
+# mongomock supports neither $text nor $unionWith, so the search and view_topic routes
+# only report errors there.
+import argparse
+import os
+import random
+import statistics
+import threading
+import time
+from datetime import datetime, timedelta
+
+# Run side effects inline; the scratch database is chosen in main() before the app is imported
+os.environ.setdefault('JOBS_SYNC', '1')
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+
+WORDS = ['python', 'flask', 'mongo', 'index', 'cache', 'query', 'thread', 'socket', 'router', 'kernel',
+         'packet', 'wireless', 'satellite', 'protocol', 'network', 'compiler', 'database', 'transaction']
+
+# Round trips issued by the request currently running on each thread
+current = threading.local()
+
+def count_round_trip():
+    if getattr(current, 'round_trips', None) is not None:
+        current.round_trips += 1
+
+def install_mongomock():
+    """
+    Swap the app's MongoClient for mongomock and count collection calls as round trips.
+    """
+    try:
+        import mongomock
+    except ImportError:
+        raise SystemExit('--mongomock needs the mongomock package: pip install mongomock')
+    import database
+    database.MongoClient = mongomock.MongoClient
+    os.environ.setdefault('MONGO_CAUSAL_SESSIONS', '0')  # mongomock has no sessions
+
+    def counted(method):
+        def wrapper(*args, **kwargs):
+            count_round_trip()
+            return method(*args, **kwargs)
+        return wrapper
+
+    for name in ('find', 'find_one', 'aggregate', 'count_documents', 'estimated_document_count', 'insert_one',
+                 'insert_many', 'update_one', 'update_many', 'find_one_and_update', 'delete_one', 'delete_many',
+                 'bulk_write'):
+        setattr(mongomock.collection.Collection, name, counted(getattr(mongomock.collection.Collection, name)))
+
+def install_command_listener():
+    from pymongo import monitoring
+
+    class RoundTripCounter(monitoring.CommandListener):
+        def started(self, event):
+            count_round_trip()
+
+        def succeeded(self, event):
+            pass
+
+        def failed(self, event):
+            pass
+
+    monitoring.register(RoundTripCounter())
+
+def seed(app_module, num_users, num_posts, comments_per_post, max_depth, votes_per_post):
+    """
+    Insert users, posts, comment trees and votes in bulk, keeping denormalized fields consistent.
+    """
+    from utils import make_links_clickable, make_excerpt
+
+    db = app_module.get_db()
+    for name in ('users', 'posts', 'comments', 'votes', 'notifications'):
+        db.drop_collection(name)
+
+    usernames = [f'user{i}' for i in range(num_users)]
+    app_module.users.insert_many([
+        {'username': name, 'email': f'{name}@example.com', 'password': 'password', 'role': 'user'}
+        for name in usernames
+    ] + [{'username': 'admin', 'email': 'admin@example.com', 'password': 'admin123', 'role': 'admin'}])
+
+    now = datetime.now()
+    posts_batch = []
+    for i in range(num_posts):
+        content = ' '.join(random.choices(WORDS, k=120)) + ' https://example.com/notes'
+        upvotes, downvotes = random.randint(0, 50), random.randint(0, 20)
+        posts_batch.append({
+            'title': ' '.join(random.choices(WORDS, k=4)).title(),
+            'content': content,
+            'content_html': str(make_links_clickable(content)),
+            'excerpt': make_excerpt(content),
+            'username': random.choice(usernames),
+            'upvotes': upvotes,
+            'downvotes': downvotes,
+            'score': upvotes - downvotes,
+            'status': random.choices(['approved', 'pending', 'rejected'], weights=[8, 1, 1])[0],
+            'attachment_urls': [],
+            'timestamp': now - timedelta(minutes=i)
+        })
+    post_ids = app_module.posts.insert_many(posts_batch).inserted_ids
+
+    for post_id in post_ids:
+        thread = []  # (comment id, depth)
+        comments_batch = []
+        for i in range(comments_per_post):
+            parent = random.choice(thread) if thread and random.random() < 0.7 else (None, -1)
+            if parent[1] + 1 >= max_depth:
+                parent = (None, -1)
+            comment = {
+                'post_id': post_id,
+                'username': random.choice(usernames),
+                'comment': ' '.join(random.choices(WORDS, k=20)),
+                'attachment_urls': [],
+                'parent_comment_id': parent[0],
+                'timestamp': now + timedelta(seconds=i)
+            }
+            comment['comment_html'] = str(make_links_clickable(comment['comment']))
+            # Assign ids up front so replies can reference their parent within the same batch
+            comment['_id'] = app_module.ObjectId()
+            thread.append((comment['_id'], parent[1] + 1))
+            comments_batch.append(comment)
+        if comments_batch:
+            app_module.comments.insert_many(comments_batch)
+
+        voters = random.sample(usernames, min(votes_per_post, len(usernames)))
+        if voters:
+            app_module.votes.insert_many([
+                {'post_id': post_id, 'username': voter, 'value': random.choice([1, -1]), 'timestamp': now}
+                for voter in voters
+            ])
+
+    app_module.reconcile_user_counters()
+    app_module.ensure_indexes(db, 30 * 24 * 60 * 60)
+    return post_ids
+
+def run_route(app_module, name, make_path, requests_per_thread, threads):
+    """
+    Request a route from several threads and return latency and round-trip samples.
+    """
+    latencies = []
+    round_trips = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker():
+        client = app_module.app.test_client()
+        with client.session_transaction() as session:
+            session['username'] = 'admin'
+        for _ in range(requests_per_thread):
+            path = make_path()
+            current.round_trips = 0
+            started = time.perf_counter()
+            try:
+                response = client.get(path)
+                status = response.status_code
+            except Exception as error:  # Report failures instead of aborting the run
+                status = repr(error)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                round_trips.append(current.round_trips)
+                if status not in (200, 304):
+                    errors.append(status)
+            current.round_trips = None
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    wall_time = time.perf_counter() - started
+
+    return {
+        'route': name,
+        'requests': len(latencies),
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'throughput': len(latencies) / wall_time if wall_time else 0,
+        'round_trips': statistics.mean(round_trips) if round_trips else 0,
+        'errors': len(errors),
+        'first_error': errors[0] if errors else None
+    }
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def print_report(results):
+    print(f"{'route':<14}{'reqs':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}{'trips':>8}{'errors':>8}")
+    for result in results:
+        print(f"{result['route']:<14}{result['requests']:>6}"
+              f"{result['p50'] * 1000:>10.1f}{result['p95'] * 1000:>10.1f}{result['p99'] * 1000:>10.1f}"
+              f"{result['throughput']:>10.1f}{result['round_trips']:>8.1f}{result['errors']:>8}")
+        if result['first_error'] is not None:
+            print(f"    first error: {result['first_error']}")
+
+def check_scratch_database(name, mongomock):
+    """
+    Refuse to run against the app's configured database or a server only named in .env,
+    since seeding drops the app's collections and the run ends by dropping the database.
+    """
+    from dotenv import dotenv_values
+
+    dotenv = dotenv_values()
+    configured = {os.getenv('MONGO_DB_NAME'), dotenv.get('MONGO_DB_NAME'), 'flask_db'}
+    if name in configured:
+        raise SystemExit(f'--db {name!r} is the app\'s database; choose a scratch database for the benchmark.')
+    if not mongomock and not os.getenv('MONGO_URI'):
+        raise SystemExit('Set MONGO_URI explicitly for the benchmark server (it is not read from .env).')
+
+def main():
+    parser = argparse.ArgumentParser(description='Seed synthetic data and benchmark the main routes.')
+    parser.add_argument('--mongomock', action='store_true', help='use an in-memory mongomock database')
+    parser.add_argument('--db', default='flask_bench', help='scratch database to drop and seed')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--posts', type=int, default=500)
+    parser.add_argument('--comments', type=int, default=50, help='comments per post')
+    parser.add_argument('--depth', type=int, default=8, help='maximum comment nesting depth')
+    parser.add_argument('--votes', type=int, default=20, help='votes per post')
+    parser.add_argument('--requests', type=int, default=50, help='requests per thread per route')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--no-page-cache', action='store_true', help='disable the rendered-page cache')
+    parser.add_argument('--keep', action='store_true', help='keep the benchmark database afterwards')
+    args = parser.parse_args()
+
+    check_scratch_database(args.db, args.mongomock)
+    os.environ['MONGO_DB_NAME'] = args.db
+    if args.no_page_cache:
+        os.environ['RESPONSE_CACHE_SIZE'] = '0'
+    if args.mongomock:
+        install_mongomock()
+    else:
+        install_command_listener()
+
+    import app as app_module
+    if app_module.get_db().name != args.db:
+        raise SystemExit(f'The app is configured for {app_module.get_db().name!r}, not {args.db!r}; not seeding it.')
+
+    print(f'Seeding {args.users} users, {args.posts} posts, {args.comments} comments per post...')
+    post_ids = seed(app_module, args.users, args.posts, args.comments, args.depth, args.votes)
+    approved = [str(post['_id']) for post in app_module.posts.find({'status': 'approved'}, {'_id': 1})]
+
+    routes = [
+        ('home', lambda: '/home'),
+        ('view_topic', lambda: f'/view_topic/{random.choice(approved or post_ids)}'),
+        ('dashboard', lambda: '/dashboard'),
+        ('search', lambda: f'/search?search_type=topic&query={random.choice(WORDS)}'),
+        ('notifications', lambda: '/notifications'),
+    ]
+    results = [run_route(app_module, name, make_path, args.requests, args.threads) for name, make_path in routes]
+    print_report(results)
+
+    if not args.keep:
+        app_module.get_db().client.drop_database(app_module.get_db().name)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+import threading
+import time
+from collections import OrderedDict
+
+class ResponseCache:
+    """
+    In-process LRU cache for rendered pages. Each entry carries tags such as
+    'post:<id>' so write routes can drop exactly the pages they affect, and a TTL
+    bounds how stale a page can get after writes made by other processes.
+    Any object with the same get/set/invalidate methods can stand in as a backend.
+    """
+
+    def __init__(self, max_entries=1024, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires_at, value, tags)
+        self.keys_by_tag = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, tags=()):
+        with self.lock:
+            self._remove(key)
+            self.entries[key] = (time.time() + self.ttl, value, tuple(tags))
+            for tag in tags:
+                self.keys_by_tag.setdefault(tag, set()).add(key)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+
+    def invalidate(self, *tags):
+        with self.lock:
+            for tag in tags:
+                for key in self.keys_by_tag.pop(tag, ()):
+                    self._remove(key)
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self.keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.keys_by_tag[tag]
@@ -0,0 +1,130 @@
+import os
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+from bson.timestamp import Timestamp
+from pymongo import MongoClient
+from pymongo.read_preferences import Primary, SecondaryPreferred
+from pymongo.write_concern import WriteConcern
+
+# Connection pool settings, overridable through the environment
+MONGO_CLIENT_OPTIONS = {
+    'maxPoolSize': int(os.getenv('MONGO_MAX_POOL_SIZE', 100)),
+    'minPoolSize': int(os.getenv('MONGO_MIN_POOL_SIZE', 0)),
+    'maxIdleTimeMS': int(os.getenv('MONGO_MAX_IDLE_TIME_MS', 60000)),
+    'connectTimeoutMS': int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', 5000)),
+    'serverSelectionTimeoutMS': int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+    'socketTimeoutMS': int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', 30000)),
+    'readPreference': os.getenv('MONGO_READ_PREFERENCE', 'primary'),
+}
+
+# Database name, overridable so benchmarks and scripts can use a scratch database
+MONGO_DB_NAME = os.getenv('MONGO_DB_NAME', 'flask_db')
+
+# Access profiles that routes and collections can opt into (see use_profile):
+#   feed: read-only pages that tolerate bounded staleness read from secondaries
+#   majority: votes, moderation and other writes that must survive a failover
+#   best_effort: writes nobody waits for, such as notifications
+# On a standalone server every profile reads from the primary; to exercise the
+# routing locally, start a replica set (mongod --replSet rs0, then rs.initiate()
+# with a secondary) and connect with MONGO_URI=mongodb://localhost:27017/?replicaSet=rs0.
+PROFILES = {
+    'feed': {'read_preference': SecondaryPreferred(max_staleness=int(os.getenv('MONGO_MAX_STALENESS_SECONDS', 90)))},
+    'majority': {'read_preference': Primary(),
+                 'write_concern': WriteConcern('majority', wtimeout=int(os.getenv('MONGO_MAJORITY_TIMEOUT_MS', 5000)))},
+    'best_effort': {'write_concern': WriteConcern(w=0)},
+}
+
+# Collection methods that take a session, split by whether they write
+READ_METHODS = {'find', 'find_one', 'aggregate', 'count_documents', 'distinct', 'watch'}
+WRITE_METHODS = {'insert_one', 'insert_many', 'update_one', 'update_many', 'replace_one', 'delete_one',
+                 'delete_many', 'find_one_and_update', 'find_one_and_replace', 'find_one_and_delete', 'bulk_write'}
+SESSION_METHODS = READ_METHODS | WRITE_METHODS
+
+# Profile, causal session and write flag of the code currently running
+current_access = ContextVar('current_access', default=None)
+
+mongo = {'client': None, 'pid': None, 'collections': {}}
+mongo_lock = threading.Lock()
+
+def get_db():
+    """
+    Return the app database, creating one MongoClient per process on first use.
+    MongoClient is not fork-safe, so forked WSGI workers each open their own pool
+    instead of inheriting the parent's.
+    """
+    if mongo['pid'] != os.getpid():
+        with mongo_lock:
+            if mongo['pid'] != os.getpid():
+                mongo['client'] = MongoClient(os.getenv('MONGO_URI'), connect=False, **MONGO_CLIENT_OPTIONS)
+                mongo['collections'] = {}
+                mongo['pid'] = os.getpid()
+    return mongo['client'][MONGO_DB_NAME]
+
+def get_collection(name, *profiles):
+    """
+    Return a collection with the options of the given profiles applied in order.
+    Handles are cached, since with_options builds a new object on every call.
+    """
+    db = get_db()
+    collection = mongo['collections'].get((name, profiles))
+    if collection is None:
+        options = {}
+        for profile in profiles:
+            options.update(PROFILES[profile])
+        collection = db[name].with_options(**options) if options else db[name]
+        mongo['collections'][(name, profiles)] = collection
+    return collection
+
+@contextmanager
+def use_profile(profile, causal=False, after=None):
+    """
+    Run the enclosed database calls with a profile. With causal=True they share a
+    causally consistent session, so reads routed to a secondary wait until it has
+    applied the session's writes, and `after` (an operation time from last_write)
+    extends that guarantee to writes made in earlier requests.
+    Yields the access state; its 'wrote' flag tells whether anything was written.
+    """
+    access = {'profile': profile, 'session': None, 'wrote': False}
+    if causal:
+        access['session'] = get_db().client.start_session(causal_consistency=True)
+        if after:
+            access['session'].advance_operation_time(Timestamp(*after))
+    token = current_access.set(access)
+    try:
+        yield access
+    finally:
+        current_access.reset(token)
+
+def last_write(access):
+    """
+    Operation time of the session's latest operation as a (time, inc) pair, for storing between requests.
+    """
+    session = access['session']
+    if session is None or session.operation_time is None:
+        return None
+    return session.operation_time.time, session.operation_time.inc
+
+class LazyCollection:
+    """
+    Module-level handle for a collection that resolves through get_db() on each use,
+    applying the active profile (then the collection's own) and the causal session.
+    """
+
+    def __init__(self, name, profile=None):
+        self.name = name
+        self.profile = profile
+
+    def __getattr__(self, attr):
+        access = current_access.get()
+        profiles = tuple(p for p in (access and access['profile'], self.profile) if p)
+        collection = get_collection(self.name, *profiles)
+        value = getattr(collection, attr)
+        if access is not None and attr in WRITE_METHODS:
+            access['wrote'] = True
+        if access is None or access['session'] is None or attr not in SESSION_METHODS:
+            return value
+        if attr in WRITE_METHODS and not collection.write_concern.acknowledged:
+            return value  # Unacknowledged writes can't run in a session
+        return partial(value, session=access['session'])
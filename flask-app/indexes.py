@@ -0,0 +1,77 @@
+from bson.objectid import ObjectId
+from pymongo.errors import OperationFailure
+
+# Indexes the app relies on, per collection: (keys, options)
+INDEXES = {
+    'users': [
+        ([('email', 1)], {'unique': True}),
+        ([('username', 1)], {}),
+    ],
+    'posts': [
+        ([('status', 1), ('score', -1), ('_id', -1)], {}),
+        ([('username', 1), ('status', 1)], {}),
+        ([('title', 'text'), ('content', 'text')], {'weights': {'title': 10, 'content': 1}, 'name': 'posts_text'}),
+    ],
+    'comments': [
+        ([('post_id', 1), ('parent_comment_id', 1), ('timestamp', 1)], {}),
+        ([('post_id', 1), ('_id', 1)], {}),
+    ],
+    'votes': [
+        ([('post_id', 1), ('username', 1)], {'unique': True}),
+    ],
+    'notifications': [
+        ([('recipient', 1), ('_id', -1)], {}),
+    ],
+}
+
+# Representative shapes of the app's queries: (collection, filter, sort)
+QUERY_SHAPES = [
+    ('users', {'email': 'someone@example.com'}, None),
+    ('users', {'username': 'someone'}, None),
+    ('posts', {'status': 'approved'}, [('score', -1), ('_id', -1)]),
+    ('posts', {'status': 'pending'}, None),
+    ('posts', {'username': 'someone'}, None),
+    ('posts', {'username': 'someone', 'status': 'approved'}, [('_id', -1)]),
+    ('comments', {'post_id': ObjectId(), 'parent_comment_id': None}, [('timestamp', 1)]),
+    ('comments', {'post_id': ObjectId()}, None),
+    ('comments', {'post_id': ObjectId(), '_id': {'$gt': ObjectId()}}, [('_id', 1)]),
+    ('votes', {'post_id': ObjectId(), 'username': 'someone'}, None),
+    ('notifications', {}, [('_id', -1)]),
+    ('notifications', {'recipient': 'someone'}, [('_id', -1)]),
+]
+
+def ensure_indexes(db, notification_ttl):
+    """
+    Create the app's indexes. Safe to run repeatedly: existing indexes are left alone.
+    Notifications get a TTL index so they expire notification_ttl seconds after creation.
+    """
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            db[collection].create_index(keys, **options)
+    try:
+        db.notifications.create_index('timestamp', expireAfterSeconds=notification_ttl)
+    except OperationFailure:
+        # The TTL changed since the index was created; update it in place
+        db.command('collMod', 'notifications',
+                   index={'keyPattern': {'timestamp': 1}, 'expireAfterSeconds': notification_ttl})
+
+def find_collscans(db):
+    """
+    Explain every query in QUERY_SHAPES and return the ones whose winning plan
+    scans a whole collection, as human-readable descriptions.
+    """
+    collscans = []
+    for collection, query, sort in QUERY_SHAPES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = cursor.explain()['queryPlanner']['winningPlan']
+        if has_stage(plan, 'COLLSCAN'):
+            collscans.append(f'{collection}.find({query}) sort={sort}')
+    return collscans
+
+def has_stage(plan, stage):
+    if plan.get('stage') == stage:
+        return True
+    children = plan.get('inputStages', []) + [plan[key] for key in ('inputStage', 'queryPlan') if key in plan]
+    return any(has_stage(child, stage) for child in children)
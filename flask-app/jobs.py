@@ -0,0 +1,93 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+class JobQueue:
+    """
+    In-process background workers for side effects that don't need to finish
+    before a response is sent. Failed jobs are retried with exponential backoff,
+    so jobs submitted with submit() must be safe to repeat; writes that are not,
+    such as $inc, go through submit_once(). Queued jobs are drained when the process exits. Workers start on the first
+    submit in each process, so forked WSGI workers get their own threads.
+    With sync=True jobs run inline, which is handy for tests and CLI commands.
+    """
+
+    def __init__(self, workers=2, max_retries=3, retry_delay=0.5, sync=False, logger=None):
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.sync = sync
+        self.logger = logger or logging.getLogger(__name__)
+        self.queue = None
+        self.threads = []
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def submit(self, func, *args, **kwargs):
+        self._submit(func, args, kwargs, self.max_retries)
+
+    def submit_once(self, func, *args, **kwargs):
+        """
+        Run a job without retries, for writes that would be applied twice if a
+        failed attempt had reached the database. pymongo's retryable writes still
+        retry a single write once on transient errors.
+        """
+        self._submit(func, args, kwargs, 0)
+
+    def _submit(self, func, args, kwargs, retries):
+        if self.sync:
+            self._run(func, args, kwargs, retries)
+            return
+        if self.pid != os.getpid():
+            self._start()
+        self.queue.put((func, args, kwargs, retries))
+
+    def _start(self):
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.queue = queue.Queue()
+            self.threads = []
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+                thread.start()
+                self.threads.append(thread)
+            if self.pid is None:
+                atexit.register(self.shutdown)
+            self.pid = os.getpid()
+
+    def shutdown(self, timeout=30):
+        """
+        Let the workers finish every queued job, then stop them, waiting up to timeout seconds.
+        """
+        for _ in self.threads:
+            self.queue.put(None)
+        deadline = time.monotonic() + timeout
+        for thread in self.threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        self.threads = []
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            try:
+                self._run(*job)
+            except Exception:  # Never let one job take the worker down with it
+                self.logger.exception('Background worker error')
+
+    def _run(self, func, args, kwargs, retries):
+        for attempt in range(retries + 1):
+            try:
+                func(*args, **kwargs)
+                return
+            except Exception:
+                if attempt == retries:
+                    self.logger.exception('Background job %s failed after %d attempts',
+                                          getattr(func, '__qualname__', repr(func)), attempt + 1)
+                    return
+                time.sleep(self.retry_delay * 2 ** attempt)
@@ -0,0 +1,68 @@
+import logging
+import os
+import threading
+import time
+from pymongo.errors import OperationFailure, PyMongoError
+
+class CommentFeed:
+    """
+    In-process pub/sub that wakes clients waiting for new comments on a post.
+    The write routes publish directly; with watch() a MongoDB change stream on the
+    comments collection also publishes inserts made by other processes (change
+    streams need a replica set). Waiters should re-check the database after a
+    timeout anyway, so a missed wake-up only delays an update.
+    """
+
+    def __init__(self, logger=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.condition = threading.Condition()
+        self.versions = {}  # post id -> number of publishes seen
+        self.collection = None
+        self.pid = None
+
+    def version(self, post_id):
+        with self.condition:
+            return self.versions.get(post_id, 0)
+
+    def publish(self, post_id):
+        with self.condition:
+            self.versions[post_id] = self.versions.get(post_id, 0) + 1
+            self.condition.notify_all()
+
+    def wait(self, post_id, version, timeout):
+        """
+        Block until post_id gets a publish after version, or timeout seconds pass.
+        Returns whether there was a publish.
+        """
+        if self.collection is not None and self.pid != os.getpid():
+            self._start_watcher()
+        with self.condition:
+            return self.condition.wait_for(lambda: self.versions.get(post_id, 0) != version, timeout)
+
+    def watch(self, collection):
+        """
+        Publish comment inserts from a change stream on collection. The watcher thread
+        starts on the first wait in each process, so forked WSGI workers get their own.
+        """
+        self.collection = collection
+
+    def _start_watcher(self):
+        with self.condition:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+        threading.Thread(target=self._watch, name='comment-feed', daemon=True).start()
+
+    def _watch(self):
+        pipeline = [{'$match': {'operationType': 'insert'}}, {'$project': {'fullDocument.post_id': 1}}]
+        while True:
+            try:
+                with self.collection.watch(pipeline) as stream:
+                    for change in stream:
+                        self.publish(str(change['fullDocument']['post_id']))
+            except OperationFailure as error:
+                self.logger.warning('Comment change stream unavailable, using in-process updates only: %s', error)
+                return
+            except PyMongoError:
+                self.logger.exception('Comment change stream failed, reconnecting')
+                time.sleep(5)
@@ -0,0 +1,190 @@
+import threading
+import time
+from pymongo import monitoring
+
+# Histogram bucket bounds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COMMAND_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+class Histogram:
+    """
+    Cumulative histogram in the Prometheus text format, one series per label set.
+    """
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}  # labels -> [bucket counts..., count, sum]
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += 1
+        series[-1] += value
+
+    def render(self, label_names):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for labels, series in sorted(self.series.items()):
+            label_text = format_labels(label_names, labels)
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {series[-2]}')
+            lines.append(f'{self.name}_count{{{label_text}}} {series[-2]}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {series[-1]:.6f}')
+        return lines
+
+def format_labels(names, values):
+    return ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                    for name, value in zip(names, values))
+
+def command_shape(event):
+    """
+    Describe a MongoDB command by name, collection and filter keys or pipeline
+    stages, leaving out values so the slow-request log never records user data.
+    """
+    command = event.command
+    target = command.get(event.command_name)
+    shape = f'{event.command_name} {target}' if isinstance(target, str) else event.command_name
+    if isinstance(command.get('filter'), dict):
+        shape += ' {' + ', '.join(sorted(command['filter'])) + '}'
+    elif isinstance(command.get('pipeline'), list):
+        shape += ' [' + ', '.join(next(iter(stage), '?') for stage in command['pipeline']) + ']'
+    return shape
+
+class RequestMetrics(monitoring.CommandListener):
+    """
+    Per-process request instrumentation: route latency, MongoDB commands issued
+    per request (through pymongo command monitoring) and template render time.
+    Commands and renders are attributed to the request running on the same thread;
+    commands from background jobs are reported under the route "background".
+    Latency for streamed pages covers the work up to the first byte of the body.
+    """
+
+    def __init__(self, slow_request_seconds=None, logger=None):
+        self.slow_request_seconds = slow_request_seconds
+        self.logger = logger
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.requests_total = {}  # (route, method, status) -> count
+        self.request_latency = Histogram('flask_request_duration_seconds', 'Request latency by route.',
+                                         LATENCY_BUCKETS)
+        self.request_commands = Histogram('flask_request_mongo_commands', 'MongoDB commands issued per request.',
+                                          COMMAND_COUNT_BUCKETS)
+        self.command_latency = Histogram('mongo_command_duration_seconds', 'MongoDB command latency by route.',
+                                         LATENCY_BUCKETS)
+        self.render_latency = Histogram('flask_template_render_seconds', 'Template render time.', LATENCY_BUCKETS)
+
+    def init_app(self, app):
+        """
+        Hook request and template timing into the app and listen to MongoDB commands.
+        The listener applies to clients created afterwards, which database.get_db()
+        only does on first use.
+        """
+        from flask import before_render_template, template_rendered
+
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        before_render_template.connect(self.start_render, app)
+        template_rendered.connect(self.finish_render, app)
+        monitoring.register(self)
+
+    # Request timing
+    def start_request(self):
+        self.local.started = time.perf_counter()
+        self.local.commands = []  # (shape, seconds)
+        self.local.pending = {}
+        self.local.renders = []
+
+    def finish_request(self, response):
+        from flask import request
+
+        started = getattr(self.local, 'started', None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        route = request.endpoint or 'unmatched'
+        commands = self.local.commands
+        with self.lock:
+            key = (route, request.method, response.status_code)
+            self.requests_total[key] = self.requests_total.get(key, 0) + 1
+            self.request_latency.observe((route, request.method), elapsed)
+            self.request_commands.observe((route,), len(commands))
+        if self.slow_request_seconds is not None and elapsed >= self.slow_request_seconds and self.logger:
+            self.log_slow_request(request, elapsed, commands, self.local.renders)
+        self.local.started = None
+        self.local.commands = None
+        return response
+
+    def log_slow_request(self, request, elapsed, commands, renders):
+        command_time = sum(seconds for _, seconds in commands)
+        lines = [f'Slow request: {request.method} {request.path} took {elapsed * 1000:.1f} ms, '
+                 f'{len(commands)} MongoDB commands ({command_time * 1000:.1f} ms), '
+                 f'templates {sum(seconds for _, seconds in renders) * 1000:.1f} ms']
+        # Group repeated shapes so N+1 patterns show up as one line with a count
+        grouped = {}
+        for shape, seconds in commands:
+            count, total = grouped.get(shape, (0, 0))
+            grouped[shape] = (count + 1, total + seconds)
+        for shape, (count, total) in sorted(grouped.items(), key=lambda item: -item[1][1]):
+            lines.append(f'  {count}x {shape} ({total * 1000:.1f} ms)')
+        self.logger.warning('\n'.join(lines))
+
+    # Template timing
+    def start_render(self, sender, template, context, **extra):
+        self.local.render_started = time.perf_counter()
+
+    def finish_render(self, sender, template, context, **extra):
+        started = getattr(self.local, 'render_started', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        self.local.render_started = None
+        with self.lock:
+            self.render_latency.observe((template.name,), elapsed)
+        if getattr(self.local, 'started', None) is not None:
+            self.local.renders.append((template.name, elapsed))
+
+    # pymongo command monitoring
+    def started(self, event):
+        if getattr(self.local, 'started', None) is not None:
+            self.local.pending[event.request_id] = command_shape(event)
+
+    def succeeded(self, event):
+        self.record_command(event)
+
+    def failed(self, event):
+        self.record_command(event)
+
+    def record_command(self, event):
+        seconds = event.duration_micros / 1e6
+        if getattr(self.local, 'started', None) is not None:
+            from flask import request
+            route = request.endpoint or 'unmatched'
+            shape = self.local.pending.pop(event.request_id, event.command_name)
+            self.local.commands.append((shape, seconds))
+        else:
+            from flask import has_request_context, request
+            # Streamed response bodies still run in their request's context
+            route = (request.endpoint or 'unmatched') if has_request_context() else 'background'
+        with self.lock:
+            self.command_latency.observe((route, event.command_name), seconds)
+
+    def render(self):
+        """
+        Return all metrics in the Prometheus text exposition format.
+        """
+        with self.lock:
+            lines = ['# HELP flask_requests_total Requests by route and status.',
+                     '# TYPE flask_requests_total counter']
+            for labels, count in sorted(self.requests_total.items()):
+                lines.append(f'flask_requests_total{{{format_labels(("route", "method", "status"), labels)}}} {count}')
+            lines += self.request_latency.render(('route', 'method'))
+            lines += self.request_commands.render(('route',))
+            lines += self.command_latency.render(('route', 'command'))
+            lines += self.render_latency.render(('template',))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,103 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from utils import make_excerpt
+
+# Pillow renders thumbnails and PyMuPDF reads PDFs; without them attachments are just linked
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+try:
+    import pymupdf
+except ImportError:
+    pymupdf = None
+
+THUMBNAIL_WIDTH = 320
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg'}
+IMAGE_FORMATS = ['PNG', 'JPEG']
+
+def thumbnail_name(stored_name, width=THUMBNAIL_WIDTH):
+    """
+    Thumbnails are named after the attachment's content hash and the width,
+    so they never change once written and can be cached indefinitely.
+    """
+    return f'{os.path.splitext(stored_name)[0]}-{width}.jpg'
+
+def generate_preview(upload_folder, preview_folder, stored_name, width=THUMBNAIL_WIDTH):
+    """
+    Write a JPEG thumbnail of an image or of a PDF's first page, and extract a
+    text snippet and page count from PDFs. Runs in a worker process, so it only
+    takes and returns plain values. Returns the fields of the upload's 'preview'
+    (empty for unsupported or unreadable files).
+    """
+    path = os.path.join(upload_folder, stored_name)
+    extension = os.path.splitext(stored_name)[1].lower()
+    preview = {}
+    image = None
+
+    try:
+        if extension in IMAGE_EXTENSIONS and Image is not None:
+            # Pillow detects the format from the content, so only let it decode the allowed ones
+            image = Image.open(path, formats=IMAGE_FORMATS)
+            image.draft('RGB', (width, width * 2))  # JPEGs decode straight to a reduced size
+            image = image.convert('RGB')
+        elif extension == '.pdf' and pymupdf is not None:
+            with pymupdf.open(path) as document:
+                preview['pages'] = document.page_count
+                if document.page_count:
+                    page = document[0]
+                    text = make_excerpt(page.get_text())
+                    if text:
+                        preview['text'] = text
+                    if Image is not None:
+                        zoom = width / page.rect.width
+                        pixmap = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), alpha=False)
+                        image = Image.frombytes('RGB', (pixmap.width, pixmap.height), pixmap.samples)
+    except Exception:
+        return {}  # Damaged or unsupported files are just linked
+
+    if image is not None:
+        image.thumbnail((width, width * 2))
+        name = thumbnail_name(stored_name, width)
+        os.makedirs(preview_folder, exist_ok=True)
+        temp_path = os.path.join(preview_folder, name + '.part')
+        image.save(temp_path, 'JPEG', quality=80, optimize=True, progressive=True)
+        os.replace(temp_path, os.path.join(preview_folder, name))
+        preview['thumbnail'] = name
+        preview['width'], preview['height'] = image.size
+    return preview
+
+def remove_preview(preview_folder, stored_name):
+    """
+    Delete an attachment's thumbnail, ignoring files that are already gone.
+    """
+    try:
+        os.remove(os.path.join(preview_folder, thumbnail_name(stored_name)))
+    except FileNotFoundError:
+        pass
+
+class PreviewPool:
+    """
+    Process pool for generate_preview, so decoding images and PDFs neither holds
+    the GIL nor runs in the request. The pool starts on first use in each process
+    and uses spawned workers, which is safe in threaded servers.
+    With workers=0 previews are generated inline.
+    """
+
+    def __init__(self, workers=2):
+        self.workers = workers
+        self.executor = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def generate(self, upload_folder, preview_folder, stored_name):
+        if not self.workers:
+            return generate_preview(upload_folder, preview_folder, stored_name)
+        if self.pid != os.getpid():
+            with self.lock:
+                if self.pid != os.getpid():
+                    self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+                    self.pid = os.getpid()
+        return self.executor.submit(generate_preview, upload_folder, preview_folder, stored_name).result()
@@ -0,0 +1,65 @@
+import hashlib
+import os
+import tempfile
+from werkzeug.utils import secure_filename
+
+# Uploads are read and hashed in chunks of this many bytes
+CHUNK_SIZE = 64 * 1024
+
+def store_upload(file_storage, upload_folder, max_size):
+    """
+    Stream an uploaded file to a temporary file in chunks while hashing it.
+    The stored filename is derived from its SHA-256 so identical files are only
+    stored once; place_upload moves the file there once its reference is recorded.
+    Returns the stored filename, its size in bytes and the temporary path.
+    Raises ValueError if the file is larger than max_size.
+    """
+    extension = os.path.splitext(secure_filename(file_storage.filename))[1].lower()
+    digest = hashlib.sha256()
+    size = 0
+
+    fd, temp_path = tempfile.mkstemp(dir=upload_folder, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            for chunk in iter(lambda: file_storage.stream.read(CHUNK_SIZE), b''):
+                size += len(chunk)
+                if size > max_size:
+                    raise ValueError(f'{file_storage.filename} is larger than {max_size} bytes')
+                digest.update(chunk)
+                temp_file.write(chunk)
+
+    except BaseException:
+        discard_upload(temp_path)
+        raise
+
+    return digest.hexdigest() + extension, size, temp_path
+
+def place_upload(temp_path, upload_folder, stored_name):
+    """
+    Move a file received by store_upload to its stored name, or drop it if an
+    identical file is already stored. Returns True if the file was written.
+    """
+    stored_path = os.path.join(upload_folder, stored_name)
+    if os.path.exists(stored_path):
+        discard_upload(temp_path)
+        return False
+    os.replace(temp_path, stored_path)
+    return True
+
+def discard_upload(temp_path):
+    """
+    Delete a temporary upload file, ignoring files that are already gone.
+    """
+    try:
+        os.remove(temp_path)
+    except FileNotFoundError:
+        pass
+
+def remove_upload(upload_folder, stored_name):
+    """
+    Delete a stored file, ignoring files that are already gone.
+    """
+    try:
+        os.remove(os.path.join(upload_folder, secure_filename(stored_name)))
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,81 @@
+import gzip
+from bson import json_util
+from pymongo.errors import BulkWriteError
+
+# Documents are read and written in batches of this many
+BATCH_SIZE = 1000
+
+# Canonical extended JSON keeps ObjectIds, dates and Timestamps intact across a round trip
+JSON_OPTIONS = json_util.CANONICAL_JSON_OPTIONS
+
+def open_ndjson(path, mode):
+    """
+    Open an NDJSON file for text reading or writing, gzip-compressed if the path ends in .gz.
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8', compresslevel=6)
+    return open(path, mode, encoding='utf-8')
+
+def export_collection(collection, path, query=None, batch_size=BATCH_SIZE):
+    """
+    Stream the documents matching query to an NDJSON file, one document per line.
+    Returns the number of documents written.
+    """
+    count = 0
+    with open_ndjson(path, 'w') as output:
+        for document in collection.find(query or {}).sort('_id', 1).batch_size(batch_size):
+            output.write(json_util.dumps(document, json_options=JSON_OPTIONS))
+            output.write('\n')
+            count += 1
+    return count
+
+def import_collection(collection, path, batch_size=BATCH_SIZE):
+    """
+    Load an NDJSON file into a collection with batched insert_many calls.
+    Documents whose _id already exists are skipped, so an interrupted import can
+    simply be rerun. Returns the numbers of inserted and skipped documents.
+    """
+    inserted = skipped = 0
+    batch = []
+    with open_ndjson(path, 'r') as source:
+        for line in source:
+            if line.strip():
+                batch.append(json_util.loads(line, json_options=JSON_OPTIONS))
+            if len(batch) == batch_size:
+                done, duplicates = insert_batch(collection, batch)
+                inserted, skipped, batch = inserted + done, skipped + duplicates, []
+    if batch:
+        done, duplicates = insert_batch(collection, batch)
+        inserted, skipped = inserted + done, skipped + duplicates
+    return inserted, skipped
+
+def insert_batch(collection, documents):
+    """
+    Insert documents unordered, tolerating duplicate _ids. Returns (inserted, duplicates).
+    """
+    try:
+        return len(collection.insert_many(documents, ordered=False).inserted_ids), 0
+    except BulkWriteError as error:
+        errors = error.details['writeErrors']
+        if any(write_error['code'] != 11000 for write_error in errors):
+            raise
+        return error.details['nInserted'], len(errors)
+
+def archive_documents(source, archive, query, batch_size=BATCH_SIZE, on_batch=None):
+    """
+    Move the documents matching query from source to archive, one batch at a time.
+    Each batch is copied before it is deleted, so an interrupted run loses nothing
+    and a rerun skips what was already copied. on_batch, if given, is called with
+    each batch's ids after it moves. Returns the number of documents moved.
+    """
+    moved = 0
+    while True:
+        batch = list(source.find(query).sort('_id', 1).limit(batch_size))
+        if not batch:
+            return moved
+        insert_batch(archive, batch)
+        ids = [document['_id'] for document in batch]
+        source.delete_many({'_id': {'$in': ids}})
+        if on_batch:
+            on_batch(ids)
+        moved += len(ids)
@@ -1,9 +1,50 @@
 import re
+from functools import lru_cache
+from urllib.parse import urlparse, parse_qs
+from markupsafe import Markup, escape
 
+# Length of the plain-text excerpts shown on list pages
+EXCERPT_LENGTH = 300
+
+# Compiled once at import instead of on every call
+URL_PATTERN = re.compile(r'https?://\S+')
+LINK_TEMPLATE = Markup('<a href="{0}" target="_blank" style="color: blue;">{0}</a>')
+
+@lru_cache(maxsize=4096)
 def make_links_clickable(text):
     """
     Convert URLs in text to clickable links (colored blue and opening in a new tab).
-    Regular text remains black.
+    Regular text remains black. Everything else is HTML-escaped, and results are
+    cached so repeated renders of the same body skip the regex work.
+    """
+    parts = []
+    last_end = 0
+    for match in URL_PATTERN.finditer(text):
+        parts.append(escape(text[last_end:match.start()]))
+        parts.append(LINK_TEMPLATE.format(match.group(0)))
+        last_end = match.end()
+    parts.append(escape(text[last_end:]))
+    return Markup('').join(parts)
+
+def attachment_name(url):
+    """
+    Display name for an attachment URL: the original filename recorded in its
+    'name' query parameter, or the last path segment for older uploads.
+    """
+    parsed = urlparse(url)
+    return parse_qs(parsed.query).get('name', [parsed.path.rsplit('/', 1)[-1]])[0]
+
+def attachment_stored_name(url):
+    """
+    Name of the stored file behind an attachment URL (its last path segment).
+    """
+    return urlparse(url).path.rsplit('/', 1)[-1]
+
+def make_excerpt(text, length=EXCERPT_LENGTH):
+    """
+    Plain-text preview of a post body, with whitespace collapsed and cut at a word boundary.
     """
-    url_pattern = re.compile(r'https?://\S+')
-    return url_pattern.sub(r'<a href="\g<0>" target="_blank" style="color: blue;">\g<0></a>', text)
\ No newline at end of file
+    text = ' '.join(text.split())
+    if len(text) <= length:
+        return text
+    return text[:length].rsplit(' ', 1)[0] + '...'
\ No newline at end of file
@@ -0,0 +1,9 @@
+# WSGI entry point for production servers, for example:
+#   gunicorn --workers 4 --threads 4 wsgi:app
+#   waitress-serve --port 8000 wsgi:app
+# With LIVE_UPDATES=1 every open thread page holds a connection, so use an async worker:
+#   gunicorn --workers 4 --worker-class gevent wsgi:app
+# Run `flask db-init` once per deployment to seed the admin account and create indexes.
+from app import create_app
+
+app = create_app()